@@ -1,11 +1,13 @@
 import pyaudio
 import numpy as np
+from scipy.fft import rfft
 import pydirectinput
 import time
 import threading
 import tkinter as tk
 from tkinter import ttk, messagebox
 import sys
+from collections import deque
 
 # --- CONFIGURATION ---
 CHUNK = 1024
@@ -13,6 +15,9 @@ FORMAT = pyaudio.paInt16
 CHANNELS = 1
 RATE = 44100
 GAIN = 5.0
+RATIO_EPS = 1e-6  # Floor for band-ratio denominators
+UI_REFRESH_MS = 50  # Dashboard redraw period (20 Hz), independent of the audio rate
+CALIB_SECONDS = 2.0  # Recording time per calibration step
 
 # CONTROLS
 KEY_ACCEL = 'up'
@@ -21,50 +26,112 @@ KEY_LEFT = 'left'
 KEY_RIGHT = 'right'
 KEY_RESPAWN = 'enter'
 
+# Held-key state as a bitmask: bit i <-> _KEY_ORDER[i]
+_KEY_ORDER = (KEY_ACCEL, KEY_BRAKE, KEY_LEFT, KEY_RIGHT)
+
 class AudioProcessor:
-    def __init__(self, callback_update_ui):
+    def __init__(self):
         self.p = pyaudio.PyAudio()
         self.stream = None
         self.running = False
         self.calibrating = False
+        # (rms, pitch, low, mid, high) rows captured by process_loop while calibrating
+        self.calib_buf = np.empty((int(CALIB_SECONDS * RATE / CHUNK) + 4, 5))
+        self.calib_n = 0
+        # Bumped by the wizard to start a recording; only process_loop resets calib_n, when it sees a new id
+        self.calib_id = 0
+        self._calib_rec_id = 0 # Recording the rows in calib_buf belong to
         self.device_index = None
-        self.callback_update_ui = callback_update_ui
-        self.pressed = {'up':False, 'down':False, 'left':False, 'right':False, 'enter':False}
+        self._devices_cache = None
+        self.latest_ui = None  # Newest dashboard data, polled by the UI thread
+        self.pressed_bits = 0 # Currently held keys (see _KEY_ORDER)
+        self._frames = deque(maxlen=4) # Chunks pushed by the PortAudio callback
+        self._frame_ready = threading.Event()
+        self._loop_thread = None # process_loop's thread, joined before another one starts
         
-        # Thresholds (Default)
+        # DSP constants (CHUNK is fixed, so the window never changes); float32 throughout
+        # Normalised to unit sum so band energies are in amplitude units, independent of CHUNK
+        w = np.hamming(CHUNK)
+        self.window_sum = w.sum()
+        self._window = (w / self.window_sum).astype(np.float32)
+
+        # Thresholds (Default); pitch energy is in normalised units (1000 on the raw spectrum)
         self.silence_thresh = 500
         self.respawn_thresh = 15000
-        self.pitch_thresh = 1000
+        self.pitch_thresh = 1000 / self.window_sum
         self.ratio_oe = 1.5 
         self.ratio_ssh = 3.0
 
+        # Scratch buffers reused every frame
+        self._scratch = np.empty(CHUNK, dtype=np.float32)
+        self._windowed = np.empty(CHUNK, dtype=np.float32)
+        # Pitch, Low, Mid, High bands as FFT bin edges for one np.add.reduceat pass
+        bands = [(int(lo/(RATE/CHUNK)), int(hi/(RATE/CHUNK)))
+                 for lo, hi in ((100, 300), (300, 800), (2000, 4000), (5000, 10000))]
+        edges = sorted({i for band in bands for i in band})
+        self._band_edges = np.array(edges)
+        self._band_slots = np.array([edges.index(lo) for lo, _ in bands])
+
     def get_devices(self):
+        # PortAudio device queries are slow, so enumerate once and reuse the list
+        if self._devices_cache is not None:
+            return self._devices_cache
         devices = []
         try:
             info = self.p.get_host_api_info_by_index(0)
             numdevices = info.get('deviceCount')
             for i in range(0, numdevices):
-                if (self.p.get_device_info_by_host_api_device_index(0, i).get('maxInputChannels')) > 0:
-                    name = self.p.get_device_info_by_host_api_device_index(0, i).get('name')
-                    devices.append((i, name))
+                info_i = self.p.get_device_info_by_host_api_device_index(0, i)
+                if info_i.get('maxInputChannels') > 0:
+                    devices.append((i, info_i.get('name')))
+            self._devices_cache = devices
         except Exception as e:
             print(f"Audio Device Error: {e}")
         return devices
 
     def start(self, device_index):
         if self.running: return
+        if self._loop_thread is not None: # A loop that ended on its own (stream lost) must be gone first
+            self._loop_thread.join()
+            self._loop_thread = None
+        self._frames.clear()
         self.device_index = device_index
         try:
             self.stream = self.p.open(format=FORMAT, channels=CHANNELS, rate=RATE, input=True,
-                                      input_device_index=self.device_index, frames_per_buffer=CHUNK)
+                                      input_device_index=self.device_index, frames_per_buffer=CHUNK,
+                                      stream_callback=self._on_audio)
             self.running = True
-            threading.Thread(target=self.process_loop, daemon=True).start()
+            self._loop_thread = threading.Thread(target=self.process_loop, daemon=True)
+            self._loop_thread.start()
         except Exception as e:
             print(f"Error starting stream: {e}")
             self.running = False
 
+    def _on_audio(self, in_data, frame_count, time_info, status):
+        # Runs on PortAudio's thread: just hand the chunk over
+        self._frames.append(in_data)
+        self._frame_ready.set()
+        return (None, pyaudio.paContinue)
+
+    def _next_frame(self):
+        """Waits for the next chunk from the callback, dropping stale ones to avoid input lag. Returns None once stopped."""
+        while not self._frames:
+            if not self.running:
+                return None
+            if not self._frame_ready.wait(1.0):
+                raise IOError("No audio from input stream")
+            self._frame_ready.clear()
+        while len(self._frames) > 1:
+            self._frames.popleft()
+        return self._frames.popleft()
+
     def stop(self):
         self.running = False
+        self._frame_ready.set() # Wake the loop if it is waiting for audio
+        if self._loop_thread is not None: # Let it finish its frame before keys and stream are released
+            self._loop_thread.join()
+            self._loop_thread = None
+        self.latest_ui = None
         self.apply_keys(False, False, False, False)
         if self.stream:
             try:
@@ -72,44 +139,68 @@ class AudioProcessor:
                 self.stream.close()
             except: pass
 
-    def get_spectrum(self):
+    def _rms(self, data):
+        """Loads a raw chunk into the scratch buffer and returns its RMS."""
+        audio = np.multiply(np.frombuffer(data, dtype=np.int16), GAIN, out=self._scratch)
+        return np.sqrt(audio @ audio / len(audio))
+
+    def _spectral(self):
+        """Band energies (pitch, low, mid, high) of the chunk in the scratch buffer."""
+        np.multiply(self._scratch, self._window, out=self._windowed)
+        fft = rfft(self._windowed, overwrite_x=True)
+        mag = np.abs(fft)
+        return tuple(np.add.reduceat(mag, self._band_edges)[self._band_slots])
+
+    def get_spectrum(self, gate=0):
+        """Returns (rms, pitch, low, mid, high), or None once the stream is lost. Below `gate` RMS the FFT is skipped and bands are 0."""
         try:
-            data = self.stream.read(CHUNK, exception_on_overflow=False)
-            audio = np.frombuffer(data, dtype=np.int16).astype(np.float64) * GAIN
-            
-            rms = np.sqrt(np.mean(audio**2))
-            window = np.hamming(len(audio))
-            fft = np.fft.rfft(audio * window)
-            mag = np.abs(fft)
-            
-            def get_band(low, high):
-                idx_l = int(low/(RATE/CHUNK))
-                idx_h = int(high/(RATE/CHUNK))
-                return np.sum(mag[idx_l:idx_h])
-
-            e_pitch = get_band(100, 300)
-            e_low   = get_band(300, 800)
-            e_mid   = get_band(2000, 4000)
-            e_high  = get_band(5000, 10000)
-            return rms, e_pitch, e_low, e_mid, e_high
-        except:
-            return 0,0,0,0,0
+            data = self._next_frame()
+        except IOError as e:
+            print(f"Audio stream lost: {e}")
+            self.running = False
+            return None
+        if data is None: # Stopped
+            return None
+        rms = self._rms(data)
+        if rms < gate:
+            return rms, 0, 0, 0, 0
+        return (rms,) + self._spectral()
 
     def apply_keys(self, up, down, left, right):
-        keys = [(KEY_ACCEL, up), (KEY_BRAKE, down), (KEY_LEFT, left), (KEY_RIGHT, right)]
-        for k, s in keys:
-            if s and not self.pressed[k]:
-                pydirectinput.keyDown(k); self.pressed[k]=True
-            elif not s and self.pressed[k]:
-                pydirectinput.keyUp(k); self.pressed[k]=False
+        target = up | (down << 1) | (left << 2) | (right << 3)
+        diff = target ^ self.pressed_bits
+        while diff: # Only keys whose state changed
+            bit = diff & -diff
+            k = _KEY_ORDER[bit.bit_length() - 1]
+            if target & bit: pydirectinput.keyDown(k)
+            else: pydirectinput.keyUp(k)
+            diff ^= bit
+        self.pressed_bits = target
+
+    def calib_rows(self):
+        """Copy of the rows recorded since the last calib_id bump (none if process_loop hasn't seen it yet)."""
+        if self._calib_rec_id != self.calib_id:
+            return self.calib_buf[:0].copy()
+        return self.calib_buf[:self.calib_n].copy()
 
     def process_loop(self):
         while self.running:
             if self.calibrating:
-                time.sleep(0.1)
+                # Calibration: record full spectra for the wizard, keys stay untouched
+                spec = self.get_spectrum()
+                if spec is None: break
+                if self._calib_rec_id != self.calib_id: # New step: drop the previous rows
+                    self._calib_rec_id = self.calib_id
+                    self.calib_n = 0
+                if self.calib_n < len(self.calib_buf):
+                    self.calib_buf[self.calib_n] = spec
+                    self.calib_n += 1
                 continue
 
-            vol, e_pitch, e_low, e_mid, e_high = self.get_spectrum()
+            # Silent frames only need the volume, so skip the FFT for them
+            spec = self.get_spectrum(gate=self.silence_thresh)
+            if spec is None: break
+            vol, e_pitch, e_low, e_mid, e_high = spec
             up, down, left, right = False, False, False, False
             status_text = "Idle"
             
@@ -119,13 +210,13 @@ class AudioProcessor:
             elif vol > self.silence_thresh:
                 has_pitch = e_pitch > self.pitch_thresh
                 if has_pitch:
-                    ratio = e_mid / (e_low + 1)
+                    ratio = e_mid / max(e_low, RATIO_EPS)
                     if ratio > self.ratio_oe:
                         left = True; up = True; status_text = "LEFT (E)"
                     else:
                         right = True; up = True; status_text = "RIGHT (O)"
                 else:
-                    ratio = e_high / (e_mid + 1)
+                    ratio = e_high / max(e_mid, RATIO_EPS)
                     if ratio > self.ratio_ssh or ratio > 5.0:
                         up = True; status_text = "GAS (S)"
                     else:
@@ -133,7 +224,8 @@ class AudioProcessor:
 
             self.apply_keys(up, down, left, right)
             ui_data = {'vol': vol, 'pitch': e_pitch, 'status': status_text, 'keys': (up, down, left, right)}
-            self.callback_update_ui(ui_data)
+            self.latest_ui = ui_data
+        self.apply_keys(False, False, False, False) # Loop ended (stopped or stream lost): release held keys
 
 class VoiceApp(tk.Tk):
     def __init__(self):
@@ -142,7 +234,9 @@ class VoiceApp(tk.Tk):
         self.geometry("500x600")
         self.configure(bg="#222222")
         self.resizable(False, False)
-        self.processor = AudioProcessor(self.update_dashboard)
+        self.processor = AudioProcessor()
+        self._last_ui = None
+        self._last_render = (None, (None, None, None, None))
         
         style = ttk.Style()
         style.theme_use('clam')
@@ -150,6 +244,7 @@ class VoiceApp(tk.Tk):
         style.configure("Horizontal.TProgressbar", background="#00ff00", troughcolor="#444444")
         
         self.create_widgets()
+        self.after(UI_REFRESH_MS, self._poll_ui)
         
     def create_widgets(self):
         header = tk.Frame(self, bg="#222222", pady=10)
@@ -214,77 +309,106 @@ class VoiceApp(tk.Tk):
             self.btn_calib.config(state="normal")
             self.reset_ui()
 
-    def update_dashboard(self, data):
-        self.after(0, lambda: self._safe_update(data))
+    def _poll_ui(self):
+        # Redraw at a fixed rate from the newest frame instead of once per audio chunk
+        data = self.processor.latest_ui
+        if data is not None and data is not self._last_ui:
+            self._last_ui = data
+            self._safe_update(data)
+        self.after(UI_REFRESH_MS, self._poll_ui)
 
     def _safe_update(self, data):
         self.bar_vol['value'] = min(100, (data['vol'] / 5000) * 100)
-        self.bar_pitch['value'] = min(100, (data['pitch'] / 3000) * 100)
-        self.status_label.config(text=data['status'])
-        u, d, l, r = data['keys']
-        self.lbl_up.config(bg="#00ff00" if u else "#333333", fg="black" if u else "#555555")
-        self.lbl_down.config(bg="#ff0000" if d else "#333333", fg="white" if d else "#555555")
-        self.lbl_left.config(bg="#00ff00" if l else "#333333", fg="black" if l else "#555555")
-        self.lbl_right.config(bg="#00ff00" if r else "#333333", fg="black" if r else "#555555")
+        self.bar_pitch['value'] = min(100, (data['pitch'] * self.processor.window_sum / 3000) * 100)
+        # Only touch Tk labels whose state changed since the last render
+        status, keys = data['status'], data['keys']
+        (last_status, (lu, ld, ll, lr)), (u, d, l, r) = self._last_render, keys
+        if status != last_status: self.status_label.config(text=status)
+        if u != lu: self.lbl_up.config(bg="#00ff00" if u else "#333333", fg="black" if u else "#555555")
+        if d != ld: self.lbl_down.config(bg="#ff0000" if d else "#333333", fg="white" if d else "#555555")
+        if l != ll: self.lbl_left.config(bg="#00ff00" if l else "#333333", fg="black" if l else "#555555")
+        if r != lr: self.lbl_right.config(bg="#00ff00" if r else "#333333", fg="black" if r else "#555555")
+        self._last_render = (status, keys)
 
     def reset_ui(self):
         self.bar_vol['value'] = 0
         self.bar_pitch['value'] = 0
         self.status_label.config(text="STOPPED", fg="#aaaaaa")
         for l in [self.lbl_up, self.lbl_down, self.lbl_left, self.lbl_right]: l.config(bg="#333333")
+        self._last_render = (None, (None, None, None, None))
 
     def run_calibration_wizard(self):
         try: idx = int(self.device_combo.get().split(":")[0])
         except: 
             messagebox.showerror("Error", "Select Mic first")
             return
-        self.processor.start(idx)
+        # process_loop records spectra while calibrating (keys stay released)
         self.processor.calibrating = True
+        self.processor.start(idx)
         
-        steps = [("SILENCE", "Quiet..."), ("OOO", "Say 'OOO'"), ("EEE", "Say 'EEE'"), ("SHHH", "Say 'SHHH'"), ("SSSS", "Say 'SSSS'"), ("CLAP", "Clap!")]
+        self._calib_steps = [("SILENCE", "Quiet..."), ("OOO", "Say 'OOO'"), ("EEE", "Say 'EEE'"), ("SHHH", "Say 'SHHH'"), ("SSSS", "Say 'SSSS'"), ("CLAP", "Clap!")]
         top = tk.Toplevel(self)
         top.geometry("400x300"); top.configure(bg="#333333")
         lbl = tk.Label(top, text="...", font=("Arial", 14), bg="#333333", fg="white"); lbl.pack(pady=40)
         pb = ttk.Progressbar(top, length=300); pb.pack(pady=20)
-        results = {}
-
-        def run_step(i):
-            if i >= len(steps): finish(); return
-            name, instr = steps[i]
-            for c in range(3, 0, -1):
-                lbl.config(text=f"{instr}\nRecording in {c}..."); top.update(); time.sleep(1)
-            lbl.config(text="RECORDING...", fg="#00ff00"); top.update()
-            
-            data, st = [], time.time()
-            while time.time()-st < 2.0:
-                data.append(self.processor.get_spectrum())
-                pb['value'] = ((time.time()-st)/2.0)*100; top.update()
-            results[name] = data
-            run_step(i+1)
-
-        def finish():
-            # Logic
-            sil = max(np.mean([x[0] for x in results["SILENCE"]])*2, 500)
-            do, de = [x for x in results["OOO"] if x[0]>sil], [x for x in results["EEE"] if x[0]>sil]
-            po, pe = (np.median([x[1] for x in do]) if do else 1000), (np.median([x[1] for x in de]) if de else 1000)
-            pt = min(po, pe) * 0.4
-            ro = np.median([(x[3]/(x[2]+1)) for x in do]) if do else 0.5
-            re = np.median([(x[3]/(x[2]+1)) for x in de]) if de else 2.0
-            r_oe = (ro+re)/2
-            r_sh = np.median([(x[4]/(x[3]+1)) for x in results["SHHH"]])
-            r_s = np.median([(x[4]/(x[3]+1)) for x in results["SSSS"]])
-            r_ssh = (r_sh+r_s)/2
-            
-            self.processor.silence_thresh = sil
-            self.processor.pitch_thresh = pt
-            self.processor.ratio_oe = r_oe
-            self.processor.ratio_ssh = r_ssh
-            self.processor.respawn_thresh = np.max([x[0] for x in results["CLAP"]])*0.8
-            self.processor.calibrating = False; self.processor.stop()
-            top.destroy()
-            messagebox.showinfo("Done", "Calibration Complete!")
-
-        self.after(100, lambda: run_step(0))
+        self._calib_top, self._calib_lbl, self._calib_pb = top, lbl, pb
+        self._calib_results, self._calib_step = {}, 0
+        # after()-driven state machine: countdown -> record -> next step
+        self.after(100, lambda: self._calib_countdown(3))
+
+    def _calib_countdown(self, c):
+        if self._calib_step >= len(self._calib_steps): self._finish_calibration(); return
+        _, instr = self._calib_steps[self._calib_step]
+        if c > 0:
+            self._calib_lbl.config(text=f"{instr}\nRecording in {c}...")
+            self.after(1000, lambda: self._calib_countdown(c - 1)); return
+        self._calib_lbl.config(text="RECORDING...", fg="#00ff00")
+        # Rows captured during the countdown are discarded; every chunk from now on is kept
+        self.processor.calib_id += 1
+        self._calib_end_time = time.time() + CALIB_SECONDS
+        self._calib_tick()
+
+    def _calib_tick(self):
+        # process_loop does the recording; this only tracks the step's progress
+        remaining = self._calib_end_time - time.time()
+        if remaining > 0:
+            self._calib_pb['value'] = ((CALIB_SECONDS - remaining)/CALIB_SECONDS)*100
+            self.after(50, self._calib_tick); return
+        name = self._calib_steps[self._calib_step][0]
+        rows = self.processor.calib_rows()
+        if len(rows) == 0: # Nothing recorded: the thresholds can't be derived
+            self._abort_calibration(f"No audio was recorded during the {name} step."); return
+        self._calib_results[name] = rows
+        self._calib_step += 1
+        self._calib_countdown(3)
+
+    def _abort_calibration(self, reason):
+        self.processor.calibrating = False; self.processor.stop()
+        self._calib_top.destroy()
+        messagebox.showerror("Calibration Failed", f"{reason}\n\nThe previous thresholds were kept.")
+
+    def _finish_calibration(self):
+        r = self._calib_results
+        sil = max(r["SILENCE"][:, 0].mean()*2, 500)
+        do, de = r["OOO"][r["OOO"][:, 0] > sil], r["EEE"][r["EEE"][:, 0] > sil]
+        po_def = 1000 / self.processor.window_sum
+        po, pe = (np.median(do[:, 1]) if len(do) else po_def), (np.median(de[:, 1]) if len(de) else po_def)
+        pt = min(po, pe) * 0.4
+        ro = np.median(do[:, 3]/np.maximum(do[:, 2], RATIO_EPS)) if len(do) else 0.5
+        re = np.median(de[:, 3]/np.maximum(de[:, 2], RATIO_EPS)) if len(de) else 2.0
+        r_oe = (ro+re)/2
+        r_sh = np.median(r["SHHH"][:, 4]/np.maximum(r["SHHH"][:, 3], RATIO_EPS))
+        r_s = np.median(r["SSSS"][:, 4]/np.maximum(r["SSSS"][:, 3], RATIO_EPS))
+        r_ssh = (r_sh+r_s)/2
+        
+        self.processor.silence_thresh = sil
+        self.processor.pitch_thresh = pt
+        self.processor.ratio_oe = r_oe
+        self.processor.ratio_ssh = r_ssh
+        self.processor.respawn_thresh = r["CLAP"][:, 0].max()*0.8
+        self.processor.calibrating = False; self.processor.stop()
+        self._calib_top.destroy()
+        messagebox.showinfo("Done", "Calibration Complete!")
 
     def on_close(self):
         self.processor.stop()
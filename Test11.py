@@ -1,18 +1,23 @@
 import pyaudio
 import numpy as np
+from scipy.fft import rfft
+from numba import njit
 import pydirectinput
 import time
 import threading
 import tkinter as tk
 from tkinter import ttk, messagebox
-from collections import deque, Counter
+from collections import deque
 
 # --- CONFIGURATION ---
 CHUNK = 1024
+FFT_SIZE = 2 * CHUNK  # Spectrum over the previous + current chunk (50% overlap)
 FORMAT = pyaudio.paInt16
 CHANNELS = 1
 RATE = 44100
 GAIN = 3.0  # Software gain to boost mic sensitivity
+UI_REFRESH_MS = 50  # Dashboard redraw period (20 Hz), independent of the audio rate
+CALIB_SECONDS = 2.0  # Recording time per calibration step
 
 # CONTROLS
 KEY_ACCEL = 'up'
@@ -21,53 +26,194 @@ KEY_LEFT = 'left'
 KEY_RIGHT = 'right'
 KEY_RESPAWN = 'enter'
 
+# Command ids (returned by _decide, counted by the majority-vote smoothing)
+COMMANDS = ("IDLE", "GAS", "BRAKE", "LEFT", "RIGHT", "RESPAWN")
+
+# Slots of AudioProcessor.thresholds
+T_RESPAWN, T_SILENCE, T_ZCR, T_VOWEL_CENT, T_FRIC_CENT = range(5)
+
+# Key state as a bitmask: bit i <-> KEY_TABLE[i]
+KEY_TABLE = (KEY_ACCEL, KEY_BRAKE, KEY_LEFT, KEY_RIGHT, KEY_RESPAWN)
+CMD_KEY_BITS = {"IDLE": 0b00000, "GAS": 0b00001, "BRAKE": 0b00010,
+                "LEFT": 0b00100, "RIGHT": 0b01000, "RESPAWN": 0b10000}
+
+# --- DSP KERNELS (Numba) ---
+@njit(cache=True, fastmath=True)
+def _prep(samples, window, gain, ring, windowed):
+    """
+    One pass over the raw int16 frame: applies the gain, shifts it into the
+    2-chunk ring, writes the windowed ring for the FFT and returns
+    (RMS, Zero Crossing Rate) of the amplified new chunk.
+    """
+    n = samples.shape[0]
+    sum_sq = 0.0
+    crossings = 0
+    prev_neg = samples[0] < 0
+    for i in range(n):
+        # Previous chunk slides into the first half
+        old = ring[n + i]
+        ring[i] = old
+        windowed[i] = old * window[i]
+        v = np.float32(samples[i]) * gain
+        ring[n + i] = v
+        windowed[n + i] = v * window[n + i]
+        sum_sq += v * v
+        # Sign-bit flip count: no products, no temporary arrays
+        neg = v < 0
+        crossings += neg != prev_neg
+        prev_neg = neg
+    return np.sqrt(sum_sq / n), crossings / n
+
+@njit(cache=True, fastmath=True)
+def _centroid(spectrum, freqs):
+    """
+    Magnitude-weighted average of frequencies (0 for an empty spectrum).
+    Takes the complex rfft output directly; no magnitude array is built.
+    """
+    num = 0.0
+    den = 0.0
+    for k in range(spectrum.shape[0]):
+        c = spectrum[k]
+        m = np.sqrt(c.real * c.real + c.imag * c.imag)
+        num += freqs[k] * m
+        den += m
+    if den < 1e-9:
+        return 0.0
+    return num / den
+
+@njit(cache=True)
+def _decide(rms, zcr, centroid, T):
+    """
+    Decision Tree Logic based on DSP features. Returns an index into COMMANDS.
+    """
+    if rms > T[T_RESPAWN]:
+        return 5 # RESPAWN
+    
+    if rms < T[T_SILENCE]:
+        return 0 # IDLE
+
+    # Step 1: Voiced (Steer) vs Unvoiced (Pedal) using ZCR
+    if zcr < T[T_ZCR]:
+        # Low ZCR = Vowel Sounds (Steering)
+        # Step 2a: OOO vs EEE using Centroid
+        if centroid < T[T_VOWEL_CENT]:
+            return 3 # LEFT: OOO (Dark sound)
+        else:
+            return 4 # RIGHT: EEE (Bright sound)
+    else:
+        # High ZCR = Fricative Sounds (Pedals)
+        # Step 2b: SHHH vs SSSS using Centroid
+        if centroid < T[T_FRIC_CENT]:
+            return 2 # BRAKE: SHHH (Lower noise)
+        else:
+            return 1 # GAS: SSSS (Higher noise)
+
 class AudioProcessor:
-    def __init__(self, callback_update_ui):
+    def __init__(self):
         self.p = pyaudio.PyAudio()
         self.stream = None
         self.running = False
-        self.calibrating = False
+        self.calib_step = None # Name of the calibration step being recorded (None = normal control)
+        # (RMS, ZCR, Centroid) rows captured by process_loop while calibrating
+        self.calib_buf = np.empty((int(CALIB_SECONDS * RATE / CHUNK) + 4, 3))
+        self.calib_n = 0
+        # Bumped by the wizard to start a recording; only process_loop resets calib_n, when it sees a new id
+        self.calib_id = 0
+        self._calib_rec_id = 0 # Recording the rows in calib_buf belong to
         self.device_index = None
-        self.callback_update_ui = callback_update_ui
+        self._devices_cache = None
+        self.latest_ui = None  # Newest dashboard data, polled by the UI thread
         
         # State tracking
-        self.pressed = {'up':False, 'down':False, 'left':False, 'right':False, 'enter':False}
-        self.command_buffer = deque(maxlen=5) # Smoothing buffer (Stores last 5 commands)
+        self.pressed_bits = 0 # Currently held keys (see KEY_TABLE)
+        self.command_buffer = deque(maxlen=5) # Smoothing buffer (Stores last 5 command ids)
+        self._tally = np.zeros(len(COMMANDS), dtype=np.int32) # Votes per command in the buffer
+        self._frames = deque(maxlen=4) # Chunks pushed by the PortAudio callback
+        self._frame_ready = threading.Event()
+        self._loop_thread = None # process_loop's thread, joined before another one starts
         
-        # Thresholds (Will be overwritten by Calibration)
-        self.thresh_silence = 300    # RMS Volume
-        self.thresh_zcr = 0.15       # Split between Vowel (Steer) and Fricative (Pedal)
-        self.thresh_vowel_cent = 1500 # Split between OOO (Left) and EEE (Right)
-        self.thresh_fric_cent = 4000  # Split between SHHH (Brake) and SSSS (Gas)
-        self.thresh_respawn = 20000   # Volume for Clap/Respawn
+        # Thresholds (Will be overwritten in place by Calibration), indexed by T_*
+        self.thresholds = np.empty(5)
+        self.thresholds[T_SILENCE] = 300      # RMS Volume
+        self.thresholds[T_ZCR] = 0.15         # Split between Vowel (Steer) and Fricative (Pedal)
+        self.thresholds[T_VOWEL_CENT] = 1500  # Split between OOO (Left) and EEE (Right)
+        self.thresholds[T_FRIC_CENT] = 4000   # Split between SHHH (Brake) and SSSS (Gas)
+        self.thresholds[T_RESPAWN] = 20000    # Volume for Clap/Respawn
+
+        # DSP constants (FFT_SIZE is fixed, so these never change); float32 throughout
+        self._window = np.hamming(FFT_SIZE).astype(np.float32)
+        self._freqs = np.fft.rfftfreq(FFT_SIZE, 1.0/RATE).astype(np.float32)
+        self._gain = np.float32(GAIN)
+        # Last two amplified chunks, and the FFT input buffer reused every frame
+        self._ring = np.zeros(FFT_SIZE, dtype=np.float32)
+        self._windowed = np.empty(FFT_SIZE, dtype=np.float32)
+
+        # Compile the kernels now instead of on the first audio frame
+        _prep(np.zeros(CHUNK, dtype=np.int16), self._window, self._gain, self._ring, self._windowed)
+        _centroid(np.zeros(FFT_SIZE//2 + 1, dtype=np.complex64), self._freqs)
+        _decide(0.0, 0.0, 0.0, self.thresholds)
 
     def get_devices(self):
+        # PortAudio device queries are slow, so enumerate once and reuse the list
+        if self._devices_cache is not None:
+            return self._devices_cache
         devices = []
         try:
             info = self.p.get_host_api_info_by_index(0)
             numdevices = info.get('deviceCount')
             for i in range(0, numdevices):
-                if (self.p.get_device_info_by_host_api_device_index(0, i).get('maxInputChannels')) > 0:
-                    name = self.p.get_device_info_by_host_api_device_index(0, i).get('name')
-                    devices.append((i, name))
+                info_i = self.p.get_device_info_by_host_api_device_index(0, i)
+                if info_i.get('maxInputChannels') > 0:
+                    devices.append((i, info_i.get('name')))
+            self._devices_cache = devices
         except Exception as e:
             print(f"Audio Device Error: {e}")
         return devices
 
     def start(self, device_index):
         if self.running: return
+        if self._loop_thread is not None: # A loop that ended on its own (stream lost) must be gone first
+            self._loop_thread.join()
+            self._loop_thread = None
+        self._frames.clear()
+        self._ring.fill(0)
         self.device_index = device_index
         try:
             self.stream = self.p.open(format=FORMAT, channels=CHANNELS, rate=RATE, input=True,
-                                      input_device_index=self.device_index, frames_per_buffer=CHUNK)
+                                      input_device_index=self.device_index, frames_per_buffer=CHUNK,
+                                      stream_callback=self._on_audio)
             self.running = True
-            threading.Thread(target=self.process_loop, daemon=True).start()
+            self._loop_thread = threading.Thread(target=self.process_loop, daemon=True)
+            self._loop_thread.start()
         except Exception as e:
             print(f"Error starting stream: {e}")
             self.running = False
 
+    def _on_audio(self, in_data, frame_count, time_info, status):
+        # Runs on PortAudio's thread: just hand the chunk over
+        self._frames.append(in_data)
+        self._frame_ready.set()
+        return (None, pyaudio.paContinue)
+
+    def _next_frame(self):
+        """Waits for the next chunk from the callback, dropping stale ones to avoid input lag. Returns None once stopped."""
+        while not self._frames:
+            if not self.running:
+                return None
+            if not self._frame_ready.wait(1.0):
+                raise IOError("No audio from input stream")
+            self._frame_ready.clear()
+        while len(self._frames) > 1:
+            self._frames.popleft()
+        return self._frames.popleft()
+
     def stop(self):
         self.running = False
+        self._frame_ready.set() # Wake the loop if it is waiting for audio
+        if self._loop_thread is not None: # Let it finish its frame before keys and stream are released
+            self._loop_thread.join()
+            self._loop_thread = None
+        self.latest_ui = None
         self.apply_keys("IDLE") # Release all keys
         if self.stream:
             try:
@@ -75,107 +221,104 @@ class AudioProcessor:
                 self.stream.close()
             except: pass
 
-    def get_features(self):
+    def _time_domain(self, data):
         """
-        Extracts robust DSP features: RMS, Zero Crossing Rate, and Spectral Centroid.
+        Pushes a raw chunk into the ring / FFT buffer and returns its (RMS, ZCR).
         """
-        try:
-            data = self.stream.read(CHUNK, exception_on_overflow=False)
-            # Convert to float array for processing
-            audio = np.frombuffer(data, dtype=np.int16).astype(np.float64) * GAIN
-            
-            # 1. RMS (Volume)
-            rms = np.sqrt(np.mean(audio**2))
-            
-            # 2. Zero Crossing Rate (ZCR) - Good for distinguishing Noise vs Tone
-            # Count sign changes normalized by frame length
-            zcr = ((audio[:-1] * audio[1:]) < 0).sum() / len(audio)
-            
-            # 3. Spectral Centroid - "Brightness" of the sound
-            # Frequency Domain Analysis
-            window = np.hamming(len(audio))
-            fft_mag = np.abs(np.fft.rfft(audio * window))
-            freqs = np.fft.rfftfreq(len(audio), 1/RATE)
-            
-            # Weighted average of frequencies
-            sum_mag = np.sum(fft_mag)
-            if sum_mag < 1e-9: centroid = 0
-            else: centroid = np.sum(freqs * fft_mag) / sum_mag
+        # int16 -> float, gain, ring shift and window fused into one pass (no intermediate array)
+        # 1. RMS (Volume)
+        # 2. Zero Crossing Rate (ZCR) - Good for distinguishing Noise vs Tone
+        return _prep(np.frombuffer(data, dtype=np.int16), self._window, self._gain, self._ring, self._windowed)
 
-            return rms, zcr, centroid
-        except:
-            return 0, 0, 0
+    def _spectral(self):
+        """
+        Spectral Centroid ("Brightness" of the sound) over the last two chunks in the FFT buffer.
+        """
+        return _centroid(rfft(self._windowed, overwrite_x=True), self._freqs)
 
-    def decide_command(self, rms, zcr, centroid):
+    def get_features(self, gate=0):
         """
-        Decision Tree Logic based on DSP features
+        Extracts robust DSP features: RMS, Zero Crossing Rate, and Spectral Centroid.
+        Below `gate` RMS the FFT is skipped and the centroid is reported as 0.
+        Returns None (and stops the processor) once the audio stream is lost.
         """
-        if rms > self.thresh_respawn:
-            return "RESPAWN"
-        
-        if rms < self.thresh_silence:
-            return "IDLE"
-
-        # Step 1: Voiced (Steer) vs Unvoiced (Pedal) using ZCR
-        if zcr < self.thresh_zcr:
-            # Low ZCR = Vowel Sounds (Steering)
-            # Step 2a: OOO vs EEE using Centroid
-            if centroid < self.thresh_vowel_cent:
-                return "LEFT"  # OOO (Dark sound)
-            else:
-                return "RIGHT" # EEE (Bright sound)
-        else:
-            # High ZCR = Fricative Sounds (Pedals)
-            # Step 2b: SHHH vs SSSS using Centroid
-            if centroid < self.thresh_fric_cent:
-                return "BRAKE" # SHHH (Lower noise)
-            else:
-                return "GAS"   # SSSS (Higher noise)
+        try:
+            data = self._next_frame()
+        except IOError as e:
+            print(f"Audio stream lost: {e}")
+            self.running = False
+            return None
+        if data is None: # Stopped
+            return None
+        rms, zcr = self._time_domain(data)
+        if rms < gate:
+            return rms, zcr, 0.0
+        # 3. Spectral Centroid - Frequency Domain Analysis
+        return rms, zcr, self._spectral()
 
     def apply_keys(self, command):
-        # Map commands to boolean states
-        target = {'up':False, 'down':False, 'left':False, 'right':False, 'enter':False}
-        
-        if command == "GAS": target['up'] = True
-        elif command == "BRAKE": target['down'] = True
-        elif command == "LEFT": target['left'] = True
-        elif command == "RIGHT": target['right'] = True
-        elif command == "RESPAWN": target['enter'] = True
-        elif command == "IDLE": pass
-
-        # Apply to pydirectinput only if state changed
-        for k, pressed_now in target.items():
-            if pressed_now and not self.pressed[k]:
+        # Map command to the target key bitmask
+        target = CMD_KEY_BITS[command]
+
+        # Apply to pydirectinput only for keys whose state changed
+        diff = target ^ self.pressed_bits
+        if diff == 0:
+            return
+        while diff:
+            bit = diff & -diff
+            k = KEY_TABLE[bit.bit_length() - 1]
+            if target & bit:
                 pydirectinput.keyDown(k)
-                self.pressed[k] = True
-            elif not pressed_now and self.pressed[k]:
+            else:
                 pydirectinput.keyUp(k)
-                self.pressed[k] = False
+            diff ^= bit
+        self.pressed_bits = target
+
+    def calib_rows(self):
+        """Copy of the rows recorded since the last calib_id bump (none if process_loop hasn't seen it yet)."""
+        if self._calib_rec_id != self.calib_id:
+            return self.calib_buf[:0].copy()
+        return self.calib_buf[:self.calib_n].copy()
 
     def process_loop(self):
         while self.running:
-            if self.calibrating:
-                time.sleep(0.1)
+            if self.calib_step is not None:
+                # Calibration: record full features for the wizard, keys stay untouched
+                features = self.get_features()
+                if features is None: break
+                if self._calib_rec_id != self.calib_id: # New step: drop the previous rows
+                    self._calib_rec_id = self.calib_id
+                    self.calib_n = 0
+                if self.calib_n < len(self.calib_buf):
+                    self.calib_buf[self.calib_n] = features
+                    self.calib_n += 1
                 continue
 
-            rms, zcr, centroid = self.get_features()
+            # Silent frames are IDLE regardless of spectrum, so skip the FFT for them
+            features = self.get_features(gate=self.thresholds[T_SILENCE])
+            if features is None: break
+            rms, zcr, centroid = features
             
             # Raw Decision
-            raw_cmd = self.decide_command(rms, zcr, centroid)
+            raw_id = _decide(rms, zcr, centroid, self.thresholds)
             
-            # Smoothing (Majority Vote)
-            self.command_buffer.append(raw_cmd)
+            # Smoothing (Majority Vote), tally updated as ids enter/leave the buffer
+            if len(self.command_buffer) == self.command_buffer.maxlen:
+                self._tally[self.command_buffer[0]] -= 1
+            self.command_buffer.append(raw_id)
+            self._tally[raw_id] += 1
             # If buffer isn't full yet, just use raw
             if len(self.command_buffer) < 3:
-                final_cmd = raw_cmd
+                final_cmd = COMMANDS[raw_id]
             else:
                 # Get the most common command in the last 5 frames
-                final_cmd = Counter(self.command_buffer).most_common(1)[0][0]
+                final_cmd = COMMANDS[int(self._tally.argmax())]
 
             self.apply_keys(final_cmd)
             
             # UI Update Data
-            keys_tuple = (self.pressed['up'], self.pressed['down'], self.pressed['left'], self.pressed['right'])
+            bits = self.pressed_bits
+            keys_tuple = (bool(bits & 0b0001), bool(bits & 0b0010), bool(bits & 0b0100), bool(bits & 0b1000))
             ui_data = {
                 'vol': rms, 
                 'zcr': zcr, 
@@ -183,7 +326,8 @@ class AudioProcessor:
                 'status': final_cmd, 
                 'keys': keys_tuple
             }
-            self.callback_update_ui(ui_data)
+            self.latest_ui = ui_data
+        self.apply_keys("IDLE") # Loop ended (stopped or stream lost): release held keys
 
 class VoiceApp(tk.Tk):
     def __init__(self):
@@ -192,7 +336,9 @@ class VoiceApp(tk.Tk):
         self.geometry("600x650")
         self.configure(bg="#222222")
         self.resizable(False, False)
-        self.processor = AudioProcessor(self.update_dashboard)
+        self.processor = AudioProcessor()
+        self._last_ui = None
+        self._last_render = (None, (None, None, None, None))
         
         style = ttk.Style()
         style.theme_use('clam')
@@ -200,6 +346,7 @@ class VoiceApp(tk.Tk):
         style.configure("Horizontal.TProgressbar", background="#00ff00", troughcolor="#444444")
         
         self.create_widgets()
+        self.after(UI_REFRESH_MS, self._poll_ui)
         
     def create_widgets(self):
         # --- HEADER ---
@@ -275,8 +422,13 @@ class VoiceApp(tk.Tk):
             self.btn_calib.config(state="normal")
             self.reset_ui()
 
-    def update_dashboard(self, data):
-        self.after(0, lambda: self._safe_update(data))
+    def _poll_ui(self):
+        # Redraw at a fixed rate from the newest frame instead of once per audio chunk
+        data = self.processor.latest_ui
+        if data is not None and data is not self._last_ui:
+            self._last_ui = data
+            self._safe_update(data)
+        self.after(UI_REFRESH_MS, self._poll_ui)
 
     def _safe_update(self, data):
         # Update Bars with scaling
@@ -284,14 +436,19 @@ class VoiceApp(tk.Tk):
         self.bar_zcr['value'] = min(100, (data['zcr'] / 0.5) * 100)       # ZCR usually 0.0 to 0.5
         self.bar_cent['value'] = min(100, (data['cent'] / 8000) * 100)    # Centroid usually 0 to 8000Hz
         
-        self.status_label.config(text=data['status'])
+        # Only touch Tk labels whose state changed since the last render
+        status, keys = data['status'], data['keys']
+        last_status, last_keys = self._last_render
+        if status != last_status: self.status_label.config(text=status)
         
         # Update Keys visual
-        u, d, l, r = data['keys']
-        self.lbl_up.config(bg="#00ff00" if u else "#333333", fg="black" if u else "#555555")
-        self.lbl_down.config(bg="#ff0000" if d else "#333333", fg="white" if d else "#555555")
-        self.lbl_left.config(bg="#00ff00" if l else "#333333", fg="black" if l else "#555555")
-        self.lbl_right.config(bg="#00ff00" if r else "#333333", fg="black" if r else "#555555")
+        u, d, l, r = keys
+        lu, ld, ll, lr = last_keys
+        if u != lu: self.lbl_up.config(bg="#00ff00" if u else "#333333", fg="black" if u else "#555555")
+        if d != ld: self.lbl_down.config(bg="#ff0000" if d else "#333333", fg="white" if d else "#555555")
+        if l != ll: self.lbl_left.config(bg="#00ff00" if l else "#333333", fg="black" if l else "#555555")
+        if r != lr: self.lbl_right.config(bg="#00ff00" if r else "#333333", fg="black" if r else "#555555")
+        self._last_render = (status, keys)
 
     def reset_ui(self):
         self.bar_vol['value'] = 0
@@ -299,6 +456,7 @@ class VoiceApp(tk.Tk):
         self.bar_cent['value'] = 0
         self.status_label.config(text="STOPPED", fg="#aaaaaa")
         for l in [self.lbl_up, self.lbl_down, self.lbl_left, self.lbl_right]: l.config(bg="#333333")
+        self._last_render = (None, (None, None, None, None))
 
     def run_calibration_wizard(self):
         try: idx = int(self.device_combo.get().split(":")[0])
@@ -306,11 +464,8 @@ class VoiceApp(tk.Tk):
             messagebox.showerror("Error", "Select Mic first")
             return
         
-        self.processor.start(idx)
-        self.processor.calibrating = True
-        
         # Calibration Steps
-        steps = [
+        self._calib_steps = [
             ("SILENCE", "Stay Quiet\n(Background Noise Level)"), 
             ("OOO", "Say 'OOO'\n(Left Turn - Low Pitch)"), 
             ("EEE", "Say 'EEE'\n(Right Turn - High Pitch)"), 
@@ -323,66 +478,91 @@ class VoiceApp(tk.Tk):
         top.geometry("450x350"); top.configure(bg="#333333")
         lbl = tk.Label(top, text="...", font=("Arial", 14), bg="#333333", fg="white"); lbl.pack(pady=40)
         pb = ttk.Progressbar(top, length=350); pb.pack(pady=20)
-        results = {}
+        self._calib_top, self._calib_lbl, self._calib_pb = top, lbl, pb
+        self._calib_results = {}
+        self._calib_step = 0
 
-        def run_step(i):
-            if i >= len(steps): finish(); return
-            name, instr = steps[i]
-            
-            # Countdown
-            for c in range(3, 0, -1):
-                lbl.config(text=f"{instr}\nRecording in {c}..."); top.update(); time.sleep(1)
-            
-            lbl.config(text="RECORDING...", fg="#00ff00"); top.update()
-            
-            # Record Data
-            data_points = []
-            st = time.time()
-            while time.time()-st < 2.0:
-                # Capture (RMS, ZCR, Centroid)
-                data_points.append(self.processor.get_features())
-                pb['value'] = ((time.time()-st)/2.0)*100; top.update()
-                time.sleep(0.05) # slight delay to not spam
-            
-            results[name] = data_points
-            run_step(i+1)
+        # process_loop records features while calib_step is set (keys stay released)
+        self.processor.calib_step = self._calib_steps[0][0]
+        self.processor.start(idx)
 
-        def finish():
-            # --- INTELLIGENT THRESHOLD CALCULATION ---
-            
-            # 1. Silence Threshold (Max RMS detected during silence * 2)
-            silence_rms = np.max([x[0] for x in results["SILENCE"]])
-            self.processor.thresh_silence = max(silence_rms * 2, 300)
-
-            # 2. Respawn Threshold (80% of clap volume)
-            clap_rms = np.max([x[0] for x in results["CLAP"]])
-            self.processor.thresh_respawn = clap_rms * 0.8
-
-            # 3. ZCR Threshold (Split Vowels vs Fricatives)
-            # Average ZCR of Vowels (OOO, EEE) vs Fricatives (SHHH, SSSS)
-            zcr_vowels = np.mean([x[1] for x in results["OOO"] + results["EEE"]])
-            zcr_frics = np.mean([x[1] for x in results["SHHH"] + results["SSSS"]])
-            self.processor.thresh_zcr = (zcr_vowels + zcr_frics) / 2
-
-            # 4. Centroid Vowel Split (OOO vs EEE)
-            # OOO should be lower freq, EEE higher freq
-            cent_o = np.mean([x[2] for x in results["OOO"]])
-            cent_e = np.mean([x[2] for x in results["EEE"]])
-            self.processor.thresh_vowel_cent = (cent_o + cent_e) / 2
-
-            # 5. Centroid Fricative Split (SHHH vs SSSS)
-            # SHHH should be lower (more "hush"), SSSS higher (more "hiss")
-            cent_sh = np.mean([x[2] for x in results["SHHH"]])
-            cent_s = np.mean([x[2] for x in results["SSSS"]])
-            self.processor.thresh_fric_cent = (cent_sh + cent_s) / 2
-
-            print(f"CALIBRATION RESULTS:\nSilence: {self.processor.thresh_silence}\nZCR Split: {self.processor.thresh_zcr}\nVowel Split: {self.processor.thresh_vowel_cent}\nFric Split: {self.processor.thresh_fric_cent}")
-            
-            self.processor.calibrating = False; self.processor.stop()
-            top.destroy()
-            messagebox.showinfo("Done", "Calibration Complete!\nSystem Adapted to your Voice.")
+        # The wizard is an after()-driven state machine: countdown -> record -> next step
+        self.after(100, lambda: self._calib_countdown(3))
 
-        self.after(100, lambda: run_step(0))
+    def _calib_countdown(self, c):
+        if self._calib_step >= len(self._calib_steps): self._finish_calibration(); return
+        name, instr = self._calib_steps[self._calib_step]
+        self.processor.calib_step = name
+        if c > 0:
+            self._calib_lbl.config(text=f"{instr}\nRecording in {c}...")
+            self.after(1000, lambda: self._calib_countdown(c - 1))
+            return
+        
+        self._calib_lbl.config(text="RECORDING...", fg="#00ff00")
+        # Rows captured during the countdown are discarded; every chunk from now on is kept
+        self.processor.calib_id += 1
+        self._calib_end_time = time.time() + CALIB_SECONDS
+        self._calib_tick()
+
+    def _calib_tick(self):
+        # process_loop does the recording; this only tracks the step's progress
+        remaining = self._calib_end_time - time.time()
+        if remaining > 0:
+            self._calib_pb['value'] = ((CALIB_SECONDS - remaining) / CALIB_SECONDS) * 100
+            self.after(50, self._calib_tick)
+            return
+        
+        name, _ = self._calib_steps[self._calib_step]
+        rows = self.processor.calib_rows()
+        if len(rows) == 0: # Nothing recorded: the thresholds can't be derived
+            self._abort_calibration(f"No audio was recorded during the {name} step.")
+            return
+        self._calib_results[name] = rows
+        self._calib_step += 1
+        self._calib_countdown(3)
+
+    def _abort_calibration(self, reason):
+        self.processor.stop(); self.processor.calib_step = None
+        self._calib_top.destroy()
+        messagebox.showerror("Calibration Failed", f"{reason}\n\nThe previous thresholds were kept.")
+
+    def _finish_calibration(self):
+        # --- INTELLIGENT THRESHOLD CALCULATION ---
+        
+        r = self._calib_results
+        T = self.processor.thresholds
+        
+        # 1. Silence Threshold (Max RMS detected during silence * 2)
+        silence_rms = r["SILENCE"][:, 0].max()
+        T[T_SILENCE] = max(silence_rms * 2, 300)
+
+        # 2. Respawn Threshold (80% of clap volume)
+        clap_rms = r["CLAP"][:, 0].max()
+        T[T_RESPAWN] = clap_rms * 0.8
+
+        # 3. ZCR Threshold (Split Vowels vs Fricatives)
+        # Average ZCR of Vowels (OOO, EEE) vs Fricatives (SHHH, SSSS)
+        zcr_vowels = np.concatenate((r["OOO"][:, 1], r["EEE"][:, 1])).mean()
+        zcr_frics = np.concatenate((r["SHHH"][:, 1], r["SSSS"][:, 1])).mean()
+        T[T_ZCR] = (zcr_vowels + zcr_frics) / 2
+
+        # 4. Centroid Vowel Split (OOO vs EEE)
+        # OOO should be lower freq, EEE higher freq
+        cent_o = r["OOO"][:, 2].mean()
+        cent_e = r["EEE"][:, 2].mean()
+        T[T_VOWEL_CENT] = (cent_o + cent_e) / 2
+
+        # 5. Centroid Fricative Split (SHHH vs SSSS)
+        # SHHH should be lower (more "hush"), SSSS higher (more "hiss")
+        cent_sh = r["SHHH"][:, 2].mean()
+        cent_s = r["SSSS"][:, 2].mean()
+        T[T_FRIC_CENT] = (cent_sh + cent_s) / 2
+
+        print(f"CALIBRATION RESULTS:\nSilence: {T[T_SILENCE]}\nZCR Split: {T[T_ZCR]}\nVowel Split: {T[T_VOWEL_CENT]}\nFric Split: {T[T_FRIC_CENT]}")
+        
+        self.processor.stop(); self.processor.calib_step = None
+        self._calib_top.destroy()
+        messagebox.showinfo("Done", "Calibration Complete!\nSystem Adapted to your Voice.")
 
     def on_close(self):
         self.processor.stop()
@@ -1,7 +1,11 @@
 import pyaudio
 import numpy as np
+from scipy.fft import rfft
+from numba import njit
 import pydirectinput
+import ctypes
 import time
+import threading
 import sys
 from collections import deque
 
@@ -11,6 +15,9 @@ FORMAT = pyaudio.paInt16
 CHANNELS = 1
 RATE = 44100
 GAIN = 5.0
+CALIB_CHUNKS = int(np.ceil(2.5 * RATE / CHUNK))  # Chunks recorded per calibration step (2.5 s)
+# Everything run_calibration sets; restored if a step records no audio
+CALIB_ATTRS = ('silence_thresh', 'pitch_thresh', 'ratio_oe', 'ratio_ssh', 'respawn_thresh', 'cls_W', 'cls_b')
 
 # CONTROLS
 KEY_ACCEL = 'up'
@@ -19,12 +26,99 @@ KEY_LEFT = 'left'
 KEY_RIGHT = 'right'
 KEY_RESPAWN = 'enter'
 
+# Held-key state as a bitmask: bit i <-> _KEY_ORDER[i]
+_KEY_ORDER = (KEY_ACCEL, KEY_BRAKE, KEY_LEFT, KEY_RIGHT)
+
+# --- KEY OUTPUT ---
+# Changed keys go out in one SendInput call per frame, built from pydirectinput's own
+# scancode table and INPUT structures (arrow keys need the extended-key flag)
+_KEY_SCAN = tuple((pydirectinput.KEYBOARD_MAPPING[k],
+                   pydirectinput.KEYEVENTF_SCANCODE |
+                   (pydirectinput.KEYEVENTF_EXTENDEDKEY if k in ('up', 'down', 'left', 'right') else 0))
+                  for k in _KEY_ORDER)
+_INPUTS = (pydirectinput.Input * len(_KEY_ORDER))()
+_EXTRA = ctypes.c_ulong(0)
+for _inp in _INPUTS:
+    _inp.type = 1 # INPUT_KEYBOARD
+    _inp.ii.ki.dwExtraInfo = ctypes.pointer(_EXTRA)
+
+def send_key_changes(target, diff):
+    """Presses/releases every key set in `diff` (state taken from `target`) with a single SendInput."""
+    n = 0
+    while diff:
+        bit = diff & -diff
+        scan, flags = _KEY_SCAN[bit.bit_length() - 1]
+        ki = _INPUTS[n].ii.ki
+        ki.wScan = scan
+        ki.dwFlags = flags if target & bit else flags | pydirectinput.KEYEVENTF_KEYUP
+        n += 1
+        diff ^= bit
+    pydirectinput.SendInput(n, _INPUTS, ctypes.sizeof(pydirectinput.Input))
+
+# Classes of the calibrated band classifier: (up, down, left, right), label
+CLASSES = (((True, False, True, False), "LEFT (E)"),
+           ((True, False, False, True), "RIGHT (O)"),
+           ((True, False, False, False), "GAS (S)"),
+           ((False, True, False, False), "BRAKE (SH)"))
+# The pitch gate picks the group first; the classifier only chooses within it
+VOWELS = slice(0, 2)
+FRICATIVES = slice(2, 4)
+
+def band_shape(bands):
+    """Loudness-independent band profile: log energies minus their mean (row or (N,4) block)."""
+    f = np.log(np.asarray(bands, dtype=np.float64) + 1)
+    return f - f.mean(axis=-1, keepdims=True)
+
+# --- DSP KERNELS (Numba) ---
+@njit(cache=True, fastmath=True, nogil=True)
+def _prep(samples, window, gain, out):
+    """
+    One pass over the raw int16 frame: applies the gain, writes the windowed
+    copy into `out` for the FFT and returns (RMS, zero crossings, RMS frequency)
+    of the amplified signal. The RMS frequency (radians/sample) comes from the
+    energy of the first difference, so it is weighted by the whole spectrum.
+    """
+    n = samples.shape[0]
+    sum_sq = 0.0
+    sum_dsq = 0.0
+    crossings = 0
+    prev = np.float32(samples[0]) * gain
+    prev_neg = prev < 0
+    for i in range(n):
+        v = np.float32(samples[i]) * gain
+        sum_sq += v * v
+        d = v - prev
+        sum_dsq += d * d
+        prev = v
+        neg = v < 0
+        crossings += neg != prev_neg
+        prev_neg = neg
+        out[i] = v * window[i]
+    freq = np.sqrt(sum_dsq / sum_sq) if sum_sq > 0 else 0.0
+    return np.sqrt(sum_sq / n), crossings, freq
+
+@njit(cache=True, fastmath=True, nogil=True)
+def _band_energies(spectrum, bands, out):
+    """
+    Sums |X[k]| over each [lo, hi) bin range of `bands` into `out`.
+    Reads the complex rfft output directly; no magnitude array is built.
+    """
+    for b in range(bands.shape[0]):
+        acc = 0.0
+        for k in range(bands[b, 0], bands[b, 1]):
+            c = spectrum[k]
+            acc += np.sqrt(c.real * c.real + c.imag * c.imag)
+        out[b] = acc
+    return out
+
 class VoiceController:
     def __init__(self):
         self.p = pyaudio.PyAudio()
         self.stream = None
         self.running = True
-        self.pressed = {'up':False, 'down':False, 'left':False, 'right':False, 'enter':False}
+        self.pressed_bits = 0 # Currently held keys (see _KEY_ORDER)
+        self._frames = deque(maxlen=4) # Chunks pushed by the PortAudio callback
+        self._frame_ready = threading.Event()
 
         # Thresholds
         self.silence_thresh = 500
@@ -37,6 +131,28 @@ class VoiceController:
         self.ratio_oe = 1.5 
         self.ratio_ssh = 3.0
 
+        # Linear band classifier (argmax(W @ shape + b) over CLASSES), set by calibration
+        self.cls_W = None
+        self.cls_b = None
+
+        # DSP constants (CHUNK and RATE are fixed, so these never change); float32 throughout
+        self.window = np.hamming(CHUNK).astype(np.float32)
+        self.gain = np.float32(GAIN)
+        bin_hz = RATE/CHUNK
+        # Band bin ranges [lo, hi): PITCH, LOW, MID, HIGH
+        self.bands = np.array([(int(lo/bin_hz), int(hi/bin_hz))
+                               for lo, hi in ((100, 300), (300, 800), (2000, 4000), (5000, 10000))])
+        # FFT input and band output buffers reused every chunk
+        self._windowed = np.empty(CHUNK, dtype=np.float32)
+        self._energies = np.empty(len(self.bands))
+        # Last computed (fingerprint, band energies); the next chunk may reuse them if it matches
+        self._spec_cache = (None, None)
+        # Compile the kernels now instead of on the first chunk
+        _prep(np.zeros(CHUNK, dtype=np.int16), self.window, self.gain, self._windowed)
+        _band_energies(np.zeros(CHUNK//2 + 1, dtype=np.complex64), self.bands, self._energies)
+        # pocketfft caches its plan per length/dtype; build the CHUNK float32 plan up front
+        rfft(np.zeros(CHUNK, dtype=np.float32))
+
     def select_device(self):
         print("\n--- MICROPHONE SELECTION ---")
         info = self.p.get_host_api_info_by_index(0)
@@ -53,82 +169,133 @@ class VoiceController:
     def start(self):
         dev_index = self.select_device()
         self.stream = self.p.open(format=FORMAT, channels=CHANNELS, rate=RATE, input=True,
-                                  input_device_index=dev_index, frames_per_buffer=CHUNK)
+                                  input_device_index=dev_index, frames_per_buffer=CHUNK,
+                                  stream_callback=self._on_audio)
         self.run_calibration()
         print("\n" + "="*40 + "\n     CONTROLLER ACTIVE\n     (Ctrl+C to Stop)\n" + "="*40)
         try:
-            while True: self.process_audio()
+            while self.running: self.process_audio()
         except KeyboardInterrupt:
             self.stop()
 
-    def get_spectrum(self):
+    def _on_audio(self, in_data, frame_count, time_info, status):
+        # Runs on PortAudio's thread: just hand the chunk over
+        self._frames.append(in_data)
+        self._frame_ready.set()
+        return (None, pyaudio.paContinue)
+
+    def _next_frame(self):
+        """
+        Waits for the next chunk from the callback, dropping stale ones to avoid input lag.
+        Returns None once running is cleared; raises IOError after 1 s without audio.
+        """
+        deadline = time.monotonic() + 1.0
+        while not self._frames:
+            if not self.running:
+                return None
+            # Short waits so a stop request is seen within 0.1 s
+            if self._frame_ready.wait(0.1):
+                self._frame_ready.clear()
+            elif time.monotonic() > deadline:
+                raise IOError("No audio from input stream")
+        while len(self._frames) > 1:
+            self._frames.popleft()
+        return self._frames.popleft()
+
+    def get_spectrum(self, gate=0):
+        """
+        Returns (rms, pitch, low, mid, high). Below `gate` RMS the FFT is skipped and bands are 0.
+        Zeros if the stream stalls (reported) or has been stopped.
+        """
         try:
-            data = self.stream.read(CHUNK, exception_on_overflow=False)
-            audio = np.frombuffer(data, dtype=np.int16).astype(np.float64) * GAIN
-            
-            # Volume
-            rms = np.sqrt(np.mean(audio**2))
-            
-            # FFT
-            window = np.hamming(len(audio))
-            fft = np.fft.rfft(audio * window)
-            mag = np.abs(fft)
-            
-            # --- THE 4 BANDS ---
-            # 1. PITCH (100-300Hz): The "Hum" of vocal cords.
-            # SHHH and SSSS have almost ZERO energy here.
-            i_pitch = (int(100/(RATE/CHUNK)), int(300/(RATE/CHUNK)))
-            e_pitch = np.sum(mag[i_pitch[0]:i_pitch[1]])
-
-            # 2. LOW (300-800Hz): The body of 'O'
-            i_low = (int(300/(RATE/CHUNK)), int(800/(RATE/CHUNK)))
-            e_low = np.sum(mag[i_low[0]:i_low[1]])
-
-            # 3. MID (2000-4000Hz): The body of 'E' and 'SH'
-            i_mid = (int(2000/(RATE/CHUNK)), int(4000/(RATE/CHUNK)))
-            e_mid = np.sum(mag[i_mid[0]:i_mid[1]])
-
-            # 4. HIGH (5000-10000Hz): The sharpness of 'S'
-            i_high = (int(5000/(RATE/CHUNK)), int(10000/(RATE/CHUNK)))
-            e_high = np.sum(mag[i_high[0]:i_high[1]])
-            
-            return rms, e_pitch, e_low, e_mid, e_high
-        except:
+            data = self._next_frame()
+        except IOError as e:
+            print(f"\nAudio stream stalled: {e}")
             return 0,0,0,0,0
+        if data is None: # Stopped
+            return 0,0,0,0,0
+        
+        # Volume (gain and window applied in the same pass)
+        rms, crossings, freq = _prep(np.frombuffer(data, dtype=np.int16), self.window, self.gain, self._windowed)
+        if rms < gate:
+            return rms, 0, 0, 0, 0
+        
+        # Held sounds give runs of near-identical chunks: same coarse volume, zero-crossing
+        # count and RMS frequency (250 Hz steps) as the previous chunk -> reuse its band
+        # energies, but for one chunk only so a miss can never go stale for longer
+        key = (int(rms / 32), crossings // 8, int(freq * RATE / (2 * np.pi * 250)))
+        if key == self._spec_cache[0]:
+            bands = self._spec_cache[1]
+            self._spec_cache = (None, None)
+            return (rms,) + bands
+        
+        # FFT
+        fft = rfft(self._windowed, overwrite_x=True)
+        
+        # --- THE 4 BANDS ---
+        # 1. PITCH (100-300Hz): The "Hum" of vocal cords.
+        #    SHHH and SSSS have almost ZERO energy here.
+        # 2. LOW (300-800Hz): The body of 'O'
+        # 3. MID (2000-4000Hz): The body of 'E' and 'SH'
+        # 4. HIGH (5000-10000Hz): The sharpness of 'S'
+        e_pitch, e_low, e_mid, e_high = _band_energies(fft, self.bands, self._energies)
+        self._spec_cache = (key, (e_pitch, e_low, e_mid, e_high))
+        
+        return rms, e_pitch, e_low, e_mid, e_high
+
+    def batch_spectrum(self, pcm):
+        """(rms, pitch, low, mid, high) rows for an (N, CHUNK) int16 block, via one batched rfft."""
+        audio = pcm.astype(np.float32) * self.gain
+        rms = np.sqrt(np.einsum('ij,ij->i', audio, audio) / CHUNK)
+        mag = np.abs(rfft(audio * self.window, axis=1, overwrite_x=True))
+        return np.column_stack([rms] + [mag[:, lo:hi].sum(axis=1) for lo, hi in self.bands])
 
     def run_calibration(self):
         print("\n=== CALIBRATION (HUM CHECK) ===")
-        
+        saved = {a: getattr(self, a) for a in CALIB_ATTRS}
+        try:
+            self._calibration_steps()
+        except IOError as e:
+            for a, v in saved.items(): setattr(self, a, v)
+            print(f"\nCalibration failed: {e}. Keeping the previous thresholds.")
+
+    def _calibration_steps(self):
         def measure(name):
             print(f"\nStep: {name}")
             print("Get Ready...", end="\r"); time.sleep(1); print("GO! (Hold sound)...")
-            vals = []
-            st = time.time()
-            while time.time()-st < 2.5: vals.append(self.get_spectrum())
-            return vals
+            # Record exactly 2.5 s worth of chunks into a preallocated block, then analyse it in one batch
+            pcm = np.empty((CALIB_CHUNKS, CHUNK), dtype=np.int16)
+            n = 0
+            try:
+                for n in range(CALIB_CHUNKS): pcm[n] = np.frombuffer(self._next_frame(), dtype=np.int16)
+                n = CALIB_CHUNKS
+            except IOError: pass
+            if n == 0: # Nothing to derive thresholds from
+                raise IOError(f"no audio recorded during the {name} step")
+            return self.batch_spectrum(pcm[:n])
 
         # 1. Silence
         input("1. Silence (Enter)...")
         data = measure("Silence")
-        self.silence_thresh = max(np.mean([x[0] for x in data]) * 2.0, 500)
+        self.silence_thresh = max(data[:, 0].mean() * 2.0, 500)
         print(f"-> Silence Floor: {int(self.silence_thresh)}")
 
         # 2. OOO
         input("2. Say 'OOO' (Enter)...")
         data_o = measure("OOO")
         # Measure Pitch (Hum) for Vowels
-        pitch_vals = [x[1] for x in data_o if x[0] > self.silence_thresh]
-        avg_pitch_o = np.median(pitch_vals) if pitch_vals else 1000
+        pitch_vals = data_o[data_o[:, 0] > self.silence_thresh, 1]
+        avg_pitch_o = np.median(pitch_vals) if len(pitch_vals) else 1000
         # Ratio O/E
-        r_o = np.median([(x[3]/(x[2]+1)) for x in data_o])
+        r_o = np.median(data_o[:, 3]/(data_o[:, 2]+1))
         print(f"-> O Pitch: {int(avg_pitch_o)} | Ratio: {r_o:.2f}")
 
         # 3. EEE
         input("3. Say 'EEE' (Enter)...")
         data_e = measure("EEE")
-        pitch_vals_e = [x[1] for x in data_e if x[0] > self.silence_thresh]
-        avg_pitch_e = np.median(pitch_vals_e) if pitch_vals_e else 1000
-        r_e = np.median([(x[3]/(x[2]+1)) for x in data_e])
+        pitch_vals_e = data_e[data_e[:, 0] > self.silence_thresh, 1]
+        avg_pitch_e = np.median(pitch_vals_e) if len(pitch_vals_e) else 1000
+        r_e = np.median(data_e[:, 3]/(data_e[:, 2]+1))
         print(f"-> E Pitch: {int(avg_pitch_e)} | Ratio: {r_e:.2f}")
         
         # Set Pitch Threshold (Critical for E vs SH)
@@ -141,32 +308,46 @@ class VoiceController:
         # 4. SHHH
         input("4. Say 'SHHH' (Brake) (Enter)...")
         data_sh = measure("SHHH")
-        r_sh = np.median([(x[4]/(x[3]+1)) for x in data_sh])
+        r_sh = np.median(data_sh[:, 4]/(data_sh[:, 3]+1))
         
         # 5. SSSS
         input("5. Say 'SSSS' (Gas) (Enter)...")
         data_s = measure("SSSS")
-        r_s = np.median([(x[4]/(x[3]+1)) for x in data_s])
+        r_s = np.median(data_s[:, 4]/(data_s[:, 3]+1))
         
         self.ratio_ssh = (r_sh + r_s) / 2
         print(f"==> S/SH Split: {self.ratio_ssh:.2f}")
+
+        # Band classifier: nearest class-mean profile, which is one linear layer
+        # W = means, b = -|mean|^2/2. Needs voiced frames for every class.
+        loud = [d[d[:, 0] > self.silence_thresh, 1:] for d in (data_e, data_o, data_s, data_sh)]
+        if all(len(x) for x in loud):
+            means = np.array([band_shape(x).mean(axis=0) for x in loud])
+            self.cls_W, self.cls_b = means, -0.5 * np.einsum('ij,ij->i', means, means)
+            print("==> Band classifier trained")
+        else:
+            print("==> Not enough sound for the classifier, using ratio thresholds")
         
         # 6. Clap
         input("6. CLAP (Enter)...")
         data = measure("Clap")
-        self.respawn_thresh = np.max([x[0] for x in data]) * 0.8
+        self.respawn_thresh = data[:, 0].max() * 0.8
         time.sleep(1)
 
     def apply(self, up, down, left, right):
-        keys = [(KEY_ACCEL, up), (KEY_BRAKE, down), (KEY_LEFT, left), (KEY_RIGHT, right)]
-        for k, s in keys:
-            if s and not self.pressed[k]:
-                pydirectinput.keyDown(k); self.pressed[k]=True
-            elif not s and self.pressed[k]:
-                pydirectinput.keyUp(k); self.pressed[k]=False
+        target = up | (down << 1) | (left << 2) | (right << 3)
+        diff = target ^ self.pressed_bits
+        if diff: send_key_changes(target, diff) # Only keys whose state changed
+        self.pressed_bits = target
+
+    def classify(self, bands, group):
+        """Nearest class-mean profile among CLASSES[group]: one small matmul on the band shape."""
+        scores = self.cls_W[group] @ band_shape(bands) + self.cls_b[group]
+        return CLASSES[group][int(np.argmax(scores))]
 
     def process_audio(self):
-        vol, e_pitch, e_low, e_mid, e_high = self.get_spectrum()
+        # Silent chunks are ignored regardless of spectrum, so skip the FFT for them
+        vol, e_pitch, e_low, e_mid, e_high = self.get_spectrum(gate=self.silence_thresh)
         up, down, left, right = False, False, False, False
         status = "..."
 
@@ -187,7 +368,11 @@ class VoiceController:
                 # Ratio: Mid / Low
                 ratio = e_mid / (e_low + 1)
                 
-                if ratio > self.ratio_oe:
+                if self.cls_W is not None:
+                    # Calibrated: nearest of the two vowel profiles
+                    (up, down, left, right), label = self.classify((e_pitch, e_low, e_mid, e_high), VOWELS)
+                    status = f"{label} [P:{int(e_pitch)}]"
+                elif ratio > self.ratio_oe:
                     left = True
                     up = True 
                     status = f"LEFT (E) [P:{int(e_pitch)}]"
@@ -204,7 +389,14 @@ class VoiceController:
                 ratio = e_high / (e_mid + 1)
                 
                 # Force SSS if ratio is huge (safety net)
-                if ratio > self.ratio_ssh or ratio > 5.0:
+                if ratio > 5.0:
+                    up = True
+                    status = f"GAS (S) [R:{ratio:.1f}]"
+                elif self.cls_W is not None:
+                    # Calibrated: nearest of the two fricative profiles
+                    (up, down, left, right), label = self.classify((e_pitch, e_low, e_mid, e_high), FRICATIVES)
+                    status = f"{label} [R:{ratio:.1f}]"
+                elif ratio > self.ratio_ssh:
                     up = True
                     status = f"GAS (S) [R:{ratio:.1f}]"
                 else:
@@ -217,6 +409,7 @@ class VoiceController:
         self.apply(up, down, left, right)
 
     def stop(self):
+        self.running = False
         self.apply(False,False,False,False)
         self.stream.stop_stream()
         self.stream.close()
@@ -1,11 +1,18 @@
 import sys
 import time
+import threading
+import multiprocessing as mp
+from multiprocessing import shared_memory
 import numpy as np
+from collections import deque
 import pyaudio
 import pydirectinput
+import ctypes
 from scipy import signal
+from scipy.fft import rfft
+from numba import njit
 from PyQt6.QtWidgets import QApplication, QMainWindow, QVBoxLayout, QWidget, QLabel
-from PyQt6.QtCore import QThread, pyqtSignal, Qt
+from PyQt6.QtCore import QTimer, Qt
 import pyqtgraph as pg
 
 # --- CONFIGURATION ---
@@ -14,6 +21,12 @@ FORMAT = pyaudio.paInt16
 CHANNELS = 1
 RATE = 44100
 GAIN = 5.0
+FFT_BINS = 300  # Spectrum bins analysed and plotted (~12.9kHz, covers every control band)
+PLOT_REFRESH_MS = 50  # Graph redraw period (20 Hz), independent of the audio rate
+PLOT_DECIMATE = 2     # Keep every Nth sample of the waveform plots
+PLOT_N = CHUNK // PLOT_DECIMATE
+PLOT_LEN = 2 * PLOT_N + FFT_BINS  # Shared plot block: [raw | filtered | fft]
+STATUS_LEN = 64       # Bytes reserved for the shared status text
 
 # CONTROLS
 KEY_ACCEL = 'up'
@@ -22,24 +35,75 @@ KEY_LEFT = 'left'
 KEY_RIGHT = 'right'
 KEY_RESPAWN = 'enter'
 
-class AudioWorker(QThread):
-    # Signals to send data back to the GUI
-    update_plots = pyqtSignal(np.ndarray, np.ndarray, np.ndarray) # Raw, Filtered, FFT
-    update_status = pyqtSignal(str, float, float) # Status text, Vol, Pitch
-    
+# Held-key state as a bitmask: bit i <-> _KEY_ORDER[i]
+_KEY_ORDER = (KEY_ACCEL, KEY_BRAKE, KEY_LEFT, KEY_RIGHT)
+
+# --- KEY OUTPUT ---
+# Changed keys go out in one SendInput call per frame, built from pydirectinput's own
+# scancode table and INPUT structures (arrow keys need the extended-key flag)
+_KEY_SCAN = tuple((pydirectinput.KEYBOARD_MAPPING[k],
+                   pydirectinput.KEYEVENTF_SCANCODE |
+                   (pydirectinput.KEYEVENTF_EXTENDEDKEY if k in ('up', 'down', 'left', 'right') else 0))
+                  for k in _KEY_ORDER)
+_INPUTS = (pydirectinput.Input * len(_KEY_ORDER))()
+_EXTRA = ctypes.c_ulong(0)
+for _inp in _INPUTS:
+    _inp.type = 1 # INPUT_KEYBOARD
+    _inp.ii.ki.dwExtraInfo = ctypes.pointer(_EXTRA)
+
+def send_key_changes(target, diff):
+    """Presses/releases every key set in `diff` (state taken from `target`) with a single SendInput."""
+    n = 0
+    while diff:
+        bit = diff & -diff
+        scan, flags = _KEY_SCAN[bit.bit_length() - 1]
+        ki = _INPUTS[n].ii.ki
+        ki.wScan = scan
+        ki.dwFlags = flags if target & bit else flags | pydirectinput.KEYEVENTF_KEYUP
+        n += 1
+        diff ^= bit
+    pydirectinput.SendInput(n, _INPUTS, ctypes.sizeof(pydirectinput.Input))
+
+# --- DSP KERNELS (Numba) ---
+@njit(cache=True, fastmath=True)
+def _rms_window(audio, window, windowed):
+    """
+    One pass over the filtered chunk: writes the windowed copy for the FFT and returns the RMS.
+    """
+    n = audio.shape[0]
+    sum_sq = 0.0
+    for i in range(n):
+        v = audio[i]
+        sum_sq += v * v
+        windowed[i] = v * window[i]
+    return np.sqrt(sum_sq / n)
+
+class AudioWorker(mp.Process):
+    """
+    Audio capture, DSP and key output in their own process, so they never wait on the GUI's GIL.
+    The GUI only sees the shared plot block / status text (see publish) and the control flags.
+    """
     def __init__(self):
-        super().__init__()
-        self.p = pyaudio.PyAudio()
+        super().__init__(daemon=True)
         self.stream = None
-        self.running = True
-        self.paused = False
+        # Control flags written by the GUI process
+        self.running = mp.Value('b', True, lock=False)
+        self.paused = mp.Value('b', False, lock=False)
         self.recalibrating = False
-        self.pressed = {'up':False, 'down':False, 'left':False, 'right':False, 'enter':False}
+        # Newest chunk for the GUI timer: PLOT_LEN float32s + status text, guarded by plot_lock;
+        # plot_seq is bumped on every write
+        self.plot_shm = shared_memory.SharedMemory(create=True, size=PLOT_LEN * 4)
+        self.plot_lock = mp.Lock()
+        self.plot_seq = mp.Value('L', 0, lock=False)
+        self.status = mp.Array('c', STATUS_LEN, lock=False)
+        self.pressed_bits = 0 # Currently held keys (see _KEY_ORDER)
         
         # DSP Filter Design (High Pass > 100Hz)
         # This removes DC offset and low rumble noise
         sos = signal.butter(10, 100, 'hp', fs=RATE, output='sos')
-        self.filter_sos = sos
+        self.filter_sos = sos.astype(np.float32) # float32 so sosfilt stays single precision
+        # Filter state carried across chunks (one (2,) delay line per section), starting at rest
+        self.filter_zi = np.zeros((sos.shape[0], 2), dtype=np.float32)
 
         # Initial Thresholds
         self.silence_thresh = 500
@@ -48,65 +112,121 @@ class AudioWorker(QThread):
         self.ratio_oe = 1.5 
         self.ratio_ssh = 3.0
 
+        # DSP constants (CHUNK and RATE are fixed, so these never change); float32 throughout
+        self.window = np.hamming(CHUNK).astype(np.float32)
+        self.gain = np.float32(GAIN)
+        # FFT input buffer reused every chunk
+        self._windowed = np.empty(CHUNK, dtype=np.float32)
+        # Spectrum reported for silent chunks
+        self._silent_mag = np.zeros(FFT_BINS, dtype=np.float32)
+        # Pitch, Low, Mid, High bands as FFT bin edges for one np.add.reduceat pass
+        bin_hz = RATE/CHUNK
+        bands = [(int(lo/bin_hz), int(hi/bin_hz))
+                 for lo, hi in ((100, 300), (300, 800), (2000, 4000), (5000, 10000))]
+        edges = sorted({i for band in bands for i in band})
+        self._band_edges = np.array(edges)
+        self._band_slots = np.array([edges.index(lo) for lo, _ in bands])
+
     def select_device(self):
         # Auto-select default device for smoother UI startup
         # In a real app, you might want a dropdown.
         return self.p.get_default_input_device_info()['index']
 
     def run(self):
+        # Worker process from here on: PortAudio and the callback hand-off live only in this process
+        self.p = pyaudio.PyAudio()
+        self._frames = deque(maxlen=4) # Chunks pushed by the PortAudio callback
+        self._frame_ready = threading.Event()
+        plots = np.ndarray((PLOT_LEN,), dtype=np.float32, buffer=self.plot_shm.buf)
+        # pocketfft caches its plan per length/dtype; build the CHUNK float32 plan up front
+        rfft(np.zeros(CHUNK, dtype=np.float32))
+        # Load/compile the kernel now instead of on the first chunk
+        _rms_window(self._windowed, self.window, self._windowed)
+
         dev_index = self.select_device()
         self.stream = self.p.open(format=FORMAT, channels=CHANNELS, rate=RATE, input=True,
-                                  input_device_index=dev_index, frames_per_buffer=CHUNK)
+                                  input_device_index=dev_index, frames_per_buffer=CHUNK,
+                                  stream_callback=self._on_audio)
         
         # Initial Calibration
         self.run_calibration()
 
-        while self.running:
-            if self.paused or self.recalibrating:
+        while self.running.value:
+            if self.paused.value or self.recalibrating:
+                self.apply_keys(False, False, False, False) # Nothing stays held while paused
                 time.sleep(0.1)
                 continue
 
             try:
                 # 1. Capture Raw Audio
-                data = self.stream.read(CHUNK, exception_on_overflow=False)
-                raw_audio = np.frombuffer(data, dtype=np.int16).astype(np.float64) * GAIN
+                data = self._next_frame()
+                if data is None: break
+                raw_audio = np.frombuffer(data, dtype=np.int16).astype(np.float32) * self.gain
                 
                 # 2. Apply Digital Filter (High Pass) - THE NEW ADDITION
                 # This makes the "Filtered" graph look different from "Raw"
-                filtered_audio = signal.sosfilt(self.filter_sos, raw_audio)
+                filtered_audio, self.filter_zi = signal.sosfilt(self.filter_sos, raw_audio, zi=self.filter_zi)
+
+                # Volume (RMS) of the filtered signal, windowed into the FFT buffer in the same pass
+                vol = _rms_window(filtered_audio, self.window, self._windowed)
 
-                # 3. FFT Analysis (Frequency Domain)
-                window = np.hamming(len(filtered_audio))
-                fft_complex = np.fft.rfft(filtered_audio * window)
-                fft_mag = np.abs(fft_complex)
+                # 3. FFT Analysis (Frequency Domain) - silent chunks are ignored, so skip it for them
+                if vol > self.silence_thresh:
+                    fft_complex = rfft(self._windowed, overwrite_x=True)
+                    # Magnitude only where it's used: the bands and the plot both live below FFT_BINS
+                    fft_mag = np.abs(fft_complex[:FFT_BINS])
+                else:
+                    fft_mag = self._silent_mag
                 
                 # Process Control Logic
-                self.process_logic(filtered_audio, fft_mag)
+                status_msg = self.process_logic(vol, fft_mag)
                 
-                # Send data to GUI
-                self.update_plots.emit(raw_audio, filtered_audio, fft_mag)
+                # Publish for the GUI timer
+                self.publish(plots, raw_audio, filtered_audio, fft_mag, status_msg)
 
             except Exception as e:
                 print(f"Error: {e}")
 
+        del plots
+        self.plot_shm.close()
         self.stop_stream()
 
-    def process_logic(self, audio, mag):
-        # Calculate Volume (RMS)
-        vol = np.sqrt(np.mean(audio**2))
-        
+    def publish(self, plots, raw, filt, mag, status_msg):
+        """Copies the newest chunk's plot data and status text into shared memory."""
+        with self.plot_lock:
+            plots[:PLOT_N] = raw[::PLOT_DECIMATE]
+            plots[PLOT_N:2*PLOT_N] = filt[::PLOT_DECIMATE]
+            plots[2*PLOT_N:] = mag
+            self.status.value = status_msg.encode()[:STATUS_LEN - 1]
+            self.plot_seq.value += 1
+
+    def _on_audio(self, in_data, frame_count, time_info, status):
+        # Runs on PortAudio's thread: just hand the chunk over
+        self._frames.append(in_data)
+        self._frame_ready.set()
+        return (None, pyaudio.paContinue)
+
+    def _next_frame(self):
+        """
+        Waits for the next chunk from the callback, dropping stale ones to avoid input lag.
+        Returns None once running is cleared; raises IOError after 1 s without audio.
+        """
+        deadline = time.monotonic() + 1.0
+        while not self._frames:
+            if not self.running.value:
+                return None
+            # Short waits so a stop request is seen within 0.1 s
+            if self._frame_ready.wait(0.1):
+                self._frame_ready.clear()
+            elif time.monotonic() > deadline:
+                raise IOError("No audio from input stream")
+        while len(self._frames) > 1:
+            self._frames.popleft()
+        return self._frames.popleft()
+
+    def process_logic(self, vol, mag):
         # Frequency Bands
-        i_pitch = (int(100/(RATE/CHUNK)), int(300/(RATE/CHUNK)))
-        e_pitch = np.sum(mag[i_pitch[0]:i_pitch[1]])
-
-        i_low = (int(300/(RATE/CHUNK)), int(800/(RATE/CHUNK)))
-        e_low = np.sum(mag[i_low[0]:i_low[1]])
-
-        i_mid = (int(2000/(RATE/CHUNK)), int(4000/(RATE/CHUNK)))
-        e_mid = np.sum(mag[i_mid[0]:i_mid[1]])
-
-        i_high = (int(5000/(RATE/CHUNK)), int(10000/(RATE/CHUNK)))
-        e_high = np.sum(mag[i_high[0]:i_high[1]])
+        e_pitch, e_low, e_mid, e_high = np.add.reduceat(mag, self._band_edges)[self._band_slots]
 
         up, down, left, right = False, False, False, False
         status_msg = "IDLE..."
@@ -138,15 +258,13 @@ class AudioWorker(QThread):
                     status_msg = f"BRAKE (SHH) [Ratio: {ratio:.1f}]"
         
         self.apply_keys(up, down, left, right)
-        self.update_status.emit(status_msg, vol, e_pitch)
+        return status_msg
 
     def apply_keys(self, up, down, left, right):
-        keys = [(KEY_ACCEL, up), (KEY_BRAKE, down), (KEY_LEFT, left), (KEY_RIGHT, right)]
-        for k, s in keys:
-            if s and not self.pressed[k]:
-                pydirectinput.keyDown(k); self.pressed[k]=True
-            elif not s and self.pressed[k]:
-                pydirectinput.keyUp(k); self.pressed[k]=False
+        target = up | (down << 1) | (left << 2) | (right << 3)
+        diff = target ^ self.pressed_bits
+        if diff: send_key_changes(target, diff) # Only keys whose state changed
+        self.pressed_bits = target
 
     def run_calibration(self):
         # A simplified, non-blocking calibration could go here
@@ -155,6 +273,7 @@ class AudioWorker(QThread):
         pass
 
     def stop_stream(self):
+        self.apply_keys(False, False, False, False) # Release held keys before the process exits
         if self.stream:
             self.stream.stop_stream()
             self.stream.close()
@@ -202,7 +321,7 @@ class MainWindow(QMainWindow):
 
         self.plot_fft = pg.PlotWidget()
         self.plot_fft.setLabel('bottom', 'Frequency Bins')
-        self.plot_fft.setRange(xRange=[0, 300], yRange=[0, 1000000]) # Zoom in on useful freqs
+        self.plot_fft.setRange(xRange=[0, FFT_BINS], yRange=[0, 1000000]) # Zoom in on useful freqs
         self.curve_fft = self.plot_fft.plot(pen=pg.mkPen('#FF69B4', width=2), fillLevel=0, brush=(255,105,180,50))
         layout.addWidget(self.plot_fft)
 
@@ -225,18 +344,36 @@ class MainWindow(QMainWindow):
         self.lbl_help.setStyleSheet("color: #777; font-size: 12px;")
         layout.addWidget(self.lbl_help)
 
-        # Start Worker Thread
+        # Start Worker Process
         self.worker = AudioWorker()
-        self.worker.update_plots.connect(self.update_graphs)
-        self.worker.update_status.connect(self.update_labels)
         self.worker.start()
+        self._plots = np.ndarray((PLOT_LEN,), dtype=np.float32, buffer=self.worker.plot_shm.buf)
+
+        # Redraw graphs and status at a fixed rate from the newest chunk
+        self._last_seq = 0
+        self._last_status = None
+        self.plot_timer = QTimer(self)
+        self.plot_timer.timeout.connect(self.poll_worker)
+        self.plot_timer.start(PLOT_REFRESH_MS)
+
+    def poll_worker(self):
+        seq = self.worker.plot_seq.value
+        if seq == self._last_seq: return
+        self._last_seq = seq
+        with self.worker.plot_lock:
+            data = self._plots.copy() # pyqtgraph keeps the arrays it's given
+            text = self.worker.status.value.decode()
+        self.update_graphs(data[:PLOT_N], data[PLOT_N:2*PLOT_N], data[2*PLOT_N:])
+        if text != self._last_status:
+            self._last_status = text
+            self.update_labels(text)
 
     def update_graphs(self, raw, filt, fft):
         self.curve_raw.setData(raw)
         self.curve_filt.setData(filt)
-        self.curve_fft.setData(fft[:300]) # Plotting first 300 bins is usually enough for voice
+        self.curve_fft.setData(fft) # First FFT_BINS bins only; enough for voice
 
-    def update_labels(self, text, vol, pitch):
+    def update_labels(self, text):
         self.lbl_status.setText(text)
         # Dynamic color changing based on detection
         if "LEFT" in text: self.lbl_status.setStyleSheet("background-color: #2E8B57; color: white; font-size: 24px; padding: 15px; border-radius:10px;")
@@ -247,16 +384,25 @@ class MainWindow(QMainWindow):
 
     def keyPressEvent(self, event):
         if event.key() == Qt.Key.Key_Escape:
-            self.worker.running = False
-            self.worker.wait()
             self.close()
         elif event.key() == Qt.Key.Key_Space:
-            self.worker.paused = not self.worker.paused
-            state = "PAUSED" if self.worker.paused else "RESUMED"
+            self.worker.paused.value = not self.worker.paused.value
+            state = "PAUSED" if self.worker.paused.value else "RESUMED"
             self.lbl_status.setText(state)
+            self._last_status = None # Repaint the worker's status on the next poll
         elif event.key() == Qt.Key.Key_R:
             self.lbl_status.setText("RECALIBRATING... (Not Implemented)")
-            # You can trigger the calibration function here in the worker thread
+            # You can trigger the calibration function here in the worker process
+
+    def closeEvent(self, event):
+        # ESC or the window's X: stop the worker cleanly so its keys are released, then free the plot block
+        self.plot_timer.stop()
+        self.worker.running.value = False
+        self.worker.join()
+        del self._plots
+        self.worker.plot_shm.close()
+        self.worker.plot_shm.unlink()
+        super().closeEvent(event)
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
@@ -4,6 +4,7 @@ import numpy as np
 import pyaudio
 import pydirectinput
 from scipy import signal
+from scipy.fft import rfft
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QVBoxLayout, QWidget, 
                              QLabel, QProgressBar, QStackedWidget, QComboBox, QPushButton, QHBoxLayout)
 from PyQt6.QtCore import QThread, pyqtSignal, Qt, QTimer
@@ -56,7 +57,17 @@ class AudioWorker(QThread):
         }
         
         # DSP Filter Design (High Pass > 100Hz)
-        self.filter_sos = signal.butter(10, 100, 'hp', fs=RATE, output='sos')
+        sos = signal.butter(10, 100, 'hp', fs=RATE, output='sos')
+        self.filter_sos = sos.astype(np.float32) # float32 so sosfilt stays single precision
+        # Filter state carried across chunks (one (2,) delay line per section), starting at rest
+        self.filter_zi = np.zeros((sos.shape[0], 2), dtype=np.float32)
+        # FFT window (CHUNK is fixed) and the windowed-input buffer reused every chunk
+        self.window = np.hamming(CHUNK).astype(np.float32)
+        self._windowed = np.empty(CHUNK, dtype=np.float32)
+        # FFT bin range [lo, hi) of each band, computed once
+        bin_hz = RATE/CHUNK
+        self.bands = {name: (int(lo/bin_hz), int(hi/bin_hz)) for name, lo, hi in
+                      (('pitch', 100, 300), ('low', 300, 800), ('mid', 2000, 4000), ('high', 5000, 10000))}
 
         # Thresholds (Will be overwritten by calibration)
         self.thresh = {
@@ -67,6 +78,15 @@ class AudioWorker(QThread):
             'ratio_ssh': 3.0
         }
 
+    def get_input_devices(self):
+        """(index, name) of every input device, from the worker's own PyAudio instance"""
+        devices = []
+        for i in range(self.p.get_device_count()):
+            info = self.p.get_device_info_by_index(i)
+            if info['maxInputChannels'] > 0:
+                devices.append((info['index'], info['name']))
+        return devices
+
     def set_device(self, index):
         self.device_index = index
 
@@ -96,12 +116,12 @@ class AudioWorker(QThread):
             try:
                 # 1. Capture & Process
                 data = self.stream.read(CHUNK, exception_on_overflow=False)
-                raw_audio = np.frombuffer(data, dtype=np.int16).astype(np.float64) * GAIN
-                filtered_audio = signal.sosfilt(self.filter_sos, raw_audio)
+                raw_audio = np.frombuffer(data, dtype=np.int16).astype(np.float32) * np.float32(GAIN)
+                filtered_audio, self.filter_zi = signal.sosfilt(self.filter_sos, raw_audio, zi=self.filter_zi)
                 
                 # FFT
-                window = np.hamming(len(raw_audio))
-                fft_complex = np.fft.rfft(raw_audio * window)
+                np.multiply(raw_audio, self.window, out=self._windowed)
+                fft_complex = rfft(self._windowed) # scipy keeps float32 input in complex64
                 fft_mag = np.abs(fft_complex)
                 
                 # Calculates metrics for the current frame
@@ -129,18 +149,17 @@ class AudioWorker(QThread):
         self.stop_stream()
 
     def calculate_metrics(self, audio, mag):
-        vol = np.sqrt(np.mean(audio**2))
+        vol = np.sqrt(audio @ audio / len(audio))
         
         # Frequency Bands
-        def get_band_energy(low_freq, high_freq):
-            idx_lo = int(low_freq / (RATE/CHUNK))
-            idx_hi = int(high_freq / (RATE/CHUNK))
-            return np.sum(mag[idx_lo:idx_hi])
-
-        e_pitch = get_band_energy(100, 300)
-        e_low = get_band_energy(300, 800)
-        e_mid = get_band_energy(2000, 4000)
-        e_high = get_band_energy(5000, 10000)
+        def get_band_energy(name):
+            lo, hi = self.bands[name]
+            return mag[lo:hi].sum()
+
+        e_pitch = get_band_energy('pitch')
+        e_low = get_band_energy('low')
+        e_mid = get_band_energy('mid')
+        e_high = get_band_energy('high')
         
         return {
             'vol': vol, 'pitch': e_pitch, 
@@ -227,7 +246,8 @@ class AudioWorker(QThread):
         if self.stream:
             self.stream.stop_stream()
             self.stream.close()
-        self.p.terminate()
+            self.stream = None
+        # self.p stays alive: the device list and a restarted run() still need it (terminated in closeEvent)
 
 class MainWindow(QMainWindow):
     def __init__(self):
@@ -342,13 +362,9 @@ class MainWindow(QMainWindow):
         self.stack.addWidget(self.page_game)
 
     def refresh_devices(self):
-        p = pyaudio.PyAudio()
         self.combo_devices.clear()
-        for i in range(p.get_device_count()):
-            info = p.get_device_info_by_index(i)
-            if info['maxInputChannels'] > 0:
-                self.combo_devices.addItem(f"{info['index']}: {info['name']}", info['index'])
-        p.terminate()
+        for index, name in self.worker.get_input_devices():
+            self.combo_devices.addItem(f"{index}: {name}", index)
 
     # --- LOGIC FLOW ---
 
@@ -454,7 +470,6 @@ class MainWindow(QMainWindow):
 
     def keyPressEvent(self, event):
         if event.key() == Qt.Key.Key_Escape:
-            self.worker.running = False
             self.close()
         elif event.key() == Qt.Key.Key_Space:
             self.worker.paused = not self.worker.paused
@@ -462,6 +477,13 @@ class MainWindow(QMainWindow):
         elif event.key() == Qt.Key.Key_R:
             self.reset_program()
 
+    def closeEvent(self, event):
+        # ESC or the window's X: let the thread release its keys and stream, then shut PortAudio down
+        self.worker.running = False
+        self.worker.wait()
+        self.worker.p.terminate()
+        super().closeEvent(event)
+
 if __name__ == "__main__":
     app = QApplication(sys.argv)
     window = MainWindow()
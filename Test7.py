@@ -1,12 +1,19 @@
 import sys
 import time
+import threading
+import multiprocessing as mp
+from multiprocessing import shared_memory
 import numpy as np
 import pyaudio
 import pydirectinput
+import ctypes
+from collections import deque
 from scipy import signal
+from scipy.fft import rfft
+from numba import njit
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QVBoxLayout, QWidget, 
                              QLabel, QProgressBar, QStackedWidget, QComboBox, QPushButton, QHBoxLayout)
-from PyQt6.QtCore import QThread, pyqtSignal, Qt, QTimer
+from PyQt6.QtCore import Qt, QTimer
 import pyqtgraph as pg
 
 # --- CONFIGURATION ---
@@ -15,6 +22,17 @@ FORMAT = pyaudio.paInt16
 CHANNELS = 1
 RATE = 44100
 GAIN = 5.0
+UI_REFRESH_MS = 33  # Graph/status redraw period (~30 Hz), independent of the audio rate
+PLOT_DECIMATE = 4   # Keep every Nth sample of the waveform plots
+FFT_BINS = 300      # Spectrum bins plotted
+PLOT_N = CHUNK // PLOT_DECIMATE
+PLOT_LEN = 2 * PLOT_N + FFT_BINS  # Shared plot block: [raw | filtered | fft]
+STATUS_LEN = 64     # Bytes reserved for the shared status text
+
+# Worker modes and threshold slots (shared with the worker process as plain numbers)
+MODE_IDLE, MODE_CALIBRATING, MODE_GAME = range(3)
+T_SILENCE, T_RESPAWN, T_PITCH, T_RATIO_OE, T_RATIO_SSH = range(5)
+CALIB_FIELDS = ('vol', 'max_vol', 'pitch', 'r_oe', 'r_ssh') # One finished calibration step
 
 # CONTROLS
 KEY_ACCEL = 'w' # up
@@ -23,124 +41,251 @@ KEY_LEFT = 'a' # left
 KEY_RIGHT = 'd' # right
 KEY_RESPAWN = 'q' # enter
 
-class AudioWorker(QThread):
-    # Signals
-    update_plots = pyqtSignal(np.ndarray, np.ndarray, np.ndarray) # Raw, Filtered, FFT
-    update_status = pyqtSignal(str, float, float) # Status, Vol, Pitch
-    calibration_progress = pyqtSignal(int, str) # Progress %, Message
-    calibration_finished = pyqtSignal(dict) # Returns calculated thresholds
-    error_occurred = pyqtSignal(str)
-
+# Held-key state as a bitmask: bit i <-> _KEY_ORDER[i]
+_KEY_ORDER = (KEY_ACCEL, KEY_BRAKE, KEY_LEFT, KEY_RIGHT)
+
+# Game decision -> (held keys as _KEY_ORDER bits, status text), indexed by
+# loud (bit 0) | pitched (bit 1) | band ratio above its split (bit 2); quiet chunks are IDLE
+_IDLE = (0, "...")
+GAME_ACTIONS = (
+    _IDLE, (0b0010, "BRAKE (SHH)"),
+    _IDLE, (0b1001, "RIGHT (OOO)"),
+    _IDLE, (0b0001, "GAS (SSS)"),
+    _IDLE, (0b0101, "LEFT (EEE)"),
+)
+
+# --- KEY OUTPUT ---
+# Changed keys go out in one SendInput call per frame, built from pydirectinput's own
+# scancode table and INPUT structures (arrow keys need the extended-key flag)
+_KEY_SCAN = tuple((pydirectinput.KEYBOARD_MAPPING[k],
+                   pydirectinput.KEYEVENTF_SCANCODE |
+                   (pydirectinput.KEYEVENTF_EXTENDEDKEY if k in ('up', 'down', 'left', 'right') else 0))
+                  for k in _KEY_ORDER)
+_INPUTS = (pydirectinput.Input * len(_KEY_ORDER))()
+_EXTRA = ctypes.c_ulong(0)
+for _inp in _INPUTS:
+    _inp.type = 1 # INPUT_KEYBOARD
+    _inp.ii.ki.dwExtraInfo = ctypes.pointer(_EXTRA)
+
+def send_key_changes(target, diff):
+    """Presses/releases every key set in `diff` (state taken from `target`) with a single SendInput."""
+    n = 0
+    while diff:
+        bit = diff & -diff
+        scan, flags = _KEY_SCAN[bit.bit_length() - 1]
+        ki = _INPUTS[n].ii.ki
+        ki.wScan = scan
+        ki.dwFlags = flags if target & bit else flags | pydirectinput.KEYEVENTF_KEYUP
+        n += 1
+        diff ^= bit
+    pydirectinput.SendInput(n, _INPUTS, ctypes.sizeof(pydirectinput.Input))
+
+# --- DSP KERNELS (Numba) ---
+@njit(cache=True, fastmath=True)
+def _prep(samples, gain, sos, zi, window, raw, filtered, windowed, gate):
+    """
+    Applies the gain to the int16 chunk and fills `raw` and the windowed raw signal
+    `windowed` for the FFT in one pass, returning the RMS of raw. If that RMS reaches
+    `gate`, `filtered` gets the high-pass biquad cascade (Direct Form II transposed,
+    per-section delays kept in `zi` across chunks); quieter chunks are only plotted,
+    so they get zeros and the filter restarts from rest.
+    """
+    n = samples.shape[0]
+    sum_sq = 0.0
+    for i in range(n):
+        v = np.float32(samples[i]) * gain
+        raw[i] = v
+        sum_sq += v * v
+        windowed[i] = v * window[i]
+    rms = np.sqrt(sum_sq / n)
+    if rms < gate:
+        filtered[:] = 0
+        zi[:] = 0
+        return rms
+    n_sections = sos.shape[0]
+    for i in range(n):
+        v = raw[i]
+        for s in range(n_sections):
+            out = sos[s, 0] * v + zi[s, 0]
+            zi[s, 0] = sos[s, 1] * v - sos[s, 4] * out + zi[s, 1]
+            zi[s, 1] = sos[s, 2] * v - sos[s, 5] * out
+            v = out
+        filtered[i] = v
+    return rms
+
+class AudioWorker(mp.Process):
+    """
+    Audio capture, DSP and key output in their own process, so they never wait on the GUI's GIL.
+    The GUI talks to it only through the shared values below and the shared plot block (see publish).
+    """
     def __init__(self):
-        super().__init__()
-        self.p = pyaudio.PyAudio()
+        super().__init__(daemon=True)
         self.stream = None
-        self.running = True
-        self.paused = False
-        self.device_index = None
+        # Control flags written by the GUI process
+        self.running = mp.Value('b', True, lock=False)
+        self.paused = mp.Value('b', False, lock=False)
+        self.device_index = None # Set before start(); the child opens this device
         
-        # Mode: 'IDLE', 'CALIBRATING', 'GAME'
-        self.mode = 'IDLE' 
-        self.calib_step = 0
-        self.calib_buffer = []
+        # Mode: MODE_IDLE, MODE_CALIBRATING, MODE_GAME (set by the GUI, back to IDLE after a step)
+        self.mode = mp.Value('b', MODE_IDLE, lock=False)
         self.calib_target_samples = 50 # How many chunks to measure per step
+        # One (vol, pitch, low, mid, high) row per measured chunk; calib_n rows filled
+        self.calib_buffer = np.empty((self.calib_target_samples, 5), dtype=np.float32)
+        self.calib_n = mp.Value('i', 0, lock=False)
+        # Finished step statistics (CALIB_FIELDS order); calib_seq is bumped once they are written
+        self.calib_result = mp.Array('d', len(CALIB_FIELDS), lock=False)
+        self.calib_seq = mp.Value('L', 0, lock=False)
+        # Newest chunk for the GUI timer: PLOT_LEN float32s + status text, guarded by plot_lock;
+        # plot_seq is bumped on every write
+        self.plot_shm = shared_memory.SharedMemory(create=True, size=PLOT_LEN * 4)
+        self.plot_lock = mp.Lock()
+        self.plot_seq = mp.Value('L', 0, lock=False)
+        self.status = mp.Array('c', STATUS_LEN, lock=False)
         
-        #self.pressed = {'up':False, 'down':False, 'left':False, 'right':False, 'enter':False}
-        # This automatically adds whatever keys you set in the CONTROLS section
-        self.pressed = {
-            KEY_ACCEL: False, 
-            KEY_BRAKE: False, 
-            KEY_LEFT: False, 
-            KEY_RIGHT: False, 
-            KEY_RESPAWN: False
-        }
+        self.pressed_bits = 0 # Currently held keys (see _KEY_ORDER)
         
-        # DSP Filter Design (High Pass > 100Hz)
-        self.filter_sos = signal.butter(10, 100, 'hp', fs=RATE, output='sos')
-
-        # Thresholds (Will be overwritten by calibration)
-        self.thresh = {
-            'silence': 500,
-            'respawn': 15000,
-            'pitch': 0,
-            'ratio_oe': 1.5,
-            'ratio_ssh': 3.0
-        }
+        # DSP Filter Design (High Pass > 100Hz); the filtered trace is only plotted, so order 6 is plenty
+        self.filter_sos = signal.butter(6, 100, 'hp', fs=RATE, output='sos').astype(np.float32)
+        # Filter state carried across chunks (one (2,) delay line per section), starting at rest
+        self.filter_zi = np.zeros((self.filter_sos.shape[0], 2), dtype=np.float32)
+        # DSP runs in float32 throughout
+        self.gain = np.float32(GAIN)
+        # FFT window (CHUNK is fixed)
+        self.window = np.hamming(CHUNK).astype(np.float32)
+        # Per-chunk buffers reused every chunk
+        self._raw = np.empty(CHUNK, dtype=np.float32)
+        self._filtered = np.empty(CHUNK, dtype=np.float32)
+        self._windowed = np.empty(CHUNK, dtype=np.float32)
+        self._fft_mag = np.empty(CHUNK//2 + 1, dtype=np.float32)
+        self._silent_mag = np.zeros(CHUNK//2 + 1, dtype=np.float32) # Spectrum reported for skipped chunks
+        # Pitch, Low, Mid, High bands as FFT bin edges for one np.add.reduceat pass
+        bin_hz = RATE/CHUNK
+        bands = [(int(lo/bin_hz), int(hi/bin_hz))
+                 for lo, hi in ((100, 300), (300, 800), (2000, 4000), (5000, 10000))]
+        edges = sorted({i for band in bands for i in band})
+        self._band_edges = np.array(edges)
+        self._band_slots = np.array([edges.index(lo) for lo, _ in bands])
+
+        # Thresholds in T_* slots (Will be overwritten by calibration)
+        self.thresh = mp.Array('d', 5, lock=False)
+        self.thresh[T_SILENCE] = 500
+        self.thresh[T_RESPAWN] = 15000
+        self.thresh[T_PITCH] = 0
+        self.thresh[T_RATIO_OE] = 1.5
+        self.thresh[T_RATIO_SSH] = 3.0
 
     def set_device(self, index):
         self.device_index = index
 
-    def start_calibration_step(self, step_num):
-        """Prepares the worker to collect data for a specific calibration step"""
-        self.calib_step = step_num
-        self.calib_buffer = [] # Clear buffer
-        self.mode = 'CALIBRATING'
+    def start_calibration_step(self):
+        """Prepares the worker to collect data for the next calibration step"""
+        self.calib_n.value = 0 # Clear buffer
+        self.mode.value = MODE_CALIBRATING
 
     def run(self):
-        if self.device_index is None:
-            self.error_occurred.emit("No Device Selected")
-            return
+        # Worker process from here on: PortAudio and the callback hand-off live only in this process
+        self.p = pyaudio.PyAudio()
+        self._frames = deque(maxlen=4) # Chunks pushed by the PortAudio callback
+        self._frame_ready = threading.Event()
+        plots = np.ndarray((PLOT_LEN,), dtype=np.float32, buffer=self.plot_shm.buf)
+        # Compile the chunk kernel now instead of on the first chunk
+        _prep(np.zeros(CHUNK, dtype=np.int16), self.gain, self.filter_sos, self.filter_zi,
+              self.window, self._raw, self._filtered, self._windowed, 0.0)
+        # pocketfft caches its plan per length/dtype; build the CHUNK float32 plan up front
+        rfft(self._windowed)
 
         try:
             self.stream = self.p.open(format=FORMAT, channels=CHANNELS, rate=RATE, input=True,
-                                      input_device_index=self.device_index, frames_per_buffer=CHUNK)
+                                      input_device_index=self.device_index, frames_per_buffer=CHUNK,
+                                      stream_callback=self._on_audio)
         except Exception as e:
-            self.error_occurred.emit(str(e))
-            return
+            print(f"Stream Error: {e}")
+            self.running.value = False
 
-        while self.running:
-            if self.paused:
+        while self.running.value:
+            if self.paused.value:
                 time.sleep(0.1)
                 continue
 
             try:
-                # 1. Capture & Process
-                data = self.stream.read(CHUNK, exception_on_overflow=False)
-                raw_audio = np.frombuffer(data, dtype=np.int16).astype(np.float64) * GAIN
-                filtered_audio = signal.sosfilt(self.filter_sos, raw_audio)
+                # 1. Capture & Process (gain, window and volume in one pass; the plotted
+                #    high-pass is skipped for chunks well below the silence floor)
+                data = self._next_frame()
+                if data is None: break
+                vol = _prep(np.frombuffer(data, dtype=np.int16), self.gain, self.filter_sos, self.filter_zi,
+                            self.window, self._raw, self._filtered, self._windowed,
+                            self.thresh[T_SILENCE] * 0.5)
                 
-                # FFT
-                window = np.hamming(len(raw_audio))
-                fft_complex = np.fft.rfft(raw_audio * window)
-                fft_mag = np.abs(fft_complex)
+                # FFT - calibration averages every chunk, but otherwise the bands are only
+                # consulted above the silence floor, so quiet chunks skip it
+                mode = self.mode.value
+                if mode == MODE_CALIBRATING or vol > self.thresh[T_SILENCE]:
+                    fft_mag = np.abs(rfft(self._windowed), out=self._fft_mag)
+                else:
+                    fft_mag = self._silent_mag
                 
                 # Calculates metrics for the current frame
-                metrics = self.calculate_metrics(raw_audio, fft_mag)
+                metrics = self.calculate_metrics(vol, fft_mag)
                 
                 # 2. Handle Modes
-                if self.mode == 'CALIBRATING':
+                if mode == MODE_CALIBRATING:
                     self.handle_calibration(metrics)
-                    status_msg = f"CALIBRATING... {len(self.calib_buffer)}/{self.calib_target_samples}"
+                    status_msg = f"CALIBRATING... {self.calib_n.value}/{self.calib_target_samples}"
                 
-                elif self.mode == 'GAME':
+                elif mode == MODE_GAME:
                     status_msg = self.handle_game_logic(metrics)
                 
                 else:
+                    self.release_all_keys() # Keys only stay held in game mode
                     status_msg = "IDLE"
 
-                # 3. Update GUI
-                self.update_plots.emit(raw_audio, filtered_audio, fft_mag)
-                self.update_status.emit(status_msg, metrics['vol'], metrics['pitch'])
+                # 3. Publish for the GUI timer
+                self.publish(plots, fft_mag, status_msg)
 
             except Exception as e:
                 print(f"Stream Error: {e}")
                 break
 
+        del plots
+        self.plot_shm.close()
         self.stop_stream()
 
-    def calculate_metrics(self, audio, mag):
-        vol = np.sqrt(np.mean(audio**2))
-        
-        # Frequency Bands
-        def get_band_energy(low_freq, high_freq):
-            idx_lo = int(low_freq / (RATE/CHUNK))
-            idx_hi = int(high_freq / (RATE/CHUNK))
-            return np.sum(mag[idx_lo:idx_hi])
-
-        e_pitch = get_band_energy(100, 300)
-        e_low = get_band_energy(300, 800)
-        e_mid = get_band_energy(2000, 4000)
-        e_high = get_band_energy(5000, 10000)
+    def publish(self, plots, mag, status_msg):
+        """Copies the newest chunk's plot data and status text into shared memory."""
+        with self.plot_lock:
+            plots[:PLOT_N] = self._raw[::PLOT_DECIMATE]
+            plots[PLOT_N:2*PLOT_N] = self._filtered[::PLOT_DECIMATE]
+            plots[2*PLOT_N:] = mag[:FFT_BINS]
+            self.status.value = status_msg.encode()[:STATUS_LEN - 1]
+            self.plot_seq.value += 1
+
+    def _on_audio(self, in_data, frame_count, time_info, status):
+        # Runs on PortAudio's thread: just hand the chunk over
+        self._frames.append(in_data)
+        self._frame_ready.set()
+        return (None, pyaudio.paContinue)
+
+    def _next_frame(self):
+        """
+        Waits for the next chunk from the callback, dropping stale ones to avoid input lag.
+        Returns None once running is cleared; raises IOError after 1 s without audio.
+        """
+        deadline = time.monotonic() + 1.0
+        while not self._frames:
+            if not self.running.value:
+                return None
+            # Short waits so a stop request is seen within 0.1 s
+            if self._frame_ready.wait(0.1):
+                self._frame_ready.clear()
+            elif time.monotonic() > deadline:
+                raise IOError("No audio from input stream")
+        while len(self._frames) > 1:
+            self._frames.popleft()
+        return self._frames.popleft()
+
+    def calculate_metrics(self, vol, mag):
+        # Frequency Bands (precomputed bin edges, one reduceat pass)
+        e_pitch, e_low, e_mid, e_high = np.add.reduceat(mag, self._band_edges)[self._band_slots]
         
         return {
             'vol': vol, 'pitch': e_pitch, 
@@ -148,84 +293,67 @@ class AudioWorker(QThread):
         }
 
     def handle_calibration(self, m):
-        # Collects N samples then processes them
-        if len(self.calib_buffer) < self.calib_target_samples:
-            self.calib_buffer.append(m)
-            progress = int((len(self.calib_buffer) / self.calib_target_samples) * 100)
-            self.calibration_progress.emit(progress, "")
+        # Collects N samples then processes them (the GUI reads the progress from calib_n)
+        n = self.calib_n.value
+        if n < self.calib_target_samples:
+            self.calib_buffer[n] = (m['vol'], m['pitch'], m['low'], m['mid'], m['high'])
+            self.calib_n.value = n + 1
         else:
             # Step Complete - Calculate Stats
-            self.mode = 'IDLE' # Pause collection
-            self.calibration_finished.emit(self.process_calibration_stats())
+            self.mode.value = MODE_IDLE # Pause collection
+            self.calib_result[:] = self.process_calibration_stats()
+            self.calib_seq.value += 1
 
     def process_calibration_stats(self):
+        n = self.calib_n.value
+        vol, pitch, low, mid, high = self.calib_buffer[:n].T
+
         # Average the collected buffer
-        avg_vol = np.mean([x['vol'] for x in self.calib_buffer])
+        avg_vol = vol.mean()
         
         # --- NEW: Also calculate the PEAK volume (for Clap) ---
-        max_vol = np.max([x['vol'] for x in self.calib_buffer]) 
+        max_vol = vol.max()
         
-        avg_pitch = np.mean([x['pitch'] for x in self.calib_buffer])
+        avg_pitch = pitch.mean()
         
         # Ratios
-        r_oe_list = [(x['mid']/(x['low']+1)) for x in self.calib_buffer]
-        r_ssh_list = [(x['high']/(x['mid']+1)) for x in self.calib_buffer]
+        r_oe = mid / (low + 1)
+        r_ssh = high / (mid + 1)
         
-        return {
-            'step': self.calib_step,
-            'vol': avg_vol,
-            'max_vol': max_vol,  # <--- Passing the Peak Volume
-            'pitch': avg_pitch,
-            'r_oe': np.median(r_oe_list) if r_oe_list else 0,
-            'r_ssh': np.median(r_ssh_list) if r_ssh_list else 0
-        }
+        # CALIB_FIELDS order
+        return (avg_vol,
+                max_vol,  # <--- Passing the Peak Volume
+                avg_pitch,
+                np.median(r_oe) if n else 0,
+                np.median(r_ssh) if n else 0)
 
     def handle_game_logic(self, m):
-        up, down, left, right = False, False, False, False
-        status = "..."
-
-        if m['vol'] > self.thresh['respawn']:
+        thresh = self.thresh
+        if m['vol'] > thresh[T_RESPAWN]:
             pydirectinput.press(KEY_RESPAWN)
             return ">>> CLAP / RESPAWN <<<"
 
-        if m['vol'] > self.thresh['silence']:
-            has_pitch = m['pitch'] > self.thresh['pitch']
-
-            if has_pitch:
-                # Vowels (O vs E)
-                ratio = m['mid'] / (m['low'] + 1)
-                if ratio > self.thresh['ratio_oe']:
-                    left = True; up = True
-                    status = f"LEFT (EEE)"
-                else:
-                    right = True; up = True
-                    status = f"RIGHT (OOO)"
-            else:
-                # Noise (S vs SH)
-                ratio = m['high'] / (m['mid'] + 1)
-                if ratio > self.thresh['ratio_ssh'] or ratio > 5.0:
-                    up = True
-                    status = f"GAS (SSS)"
-                else:
-                    down = True
-                    status = f"BRAKE (SHH)"
+        has_pitch = m['pitch'] > thresh[T_PITCH]
+        if has_pitch:
+            # Vowels (O vs E)
+            above = m['mid'] / (m['low'] + 1) > thresh[T_RATIO_OE]
+        else:
+            # Noise (S vs SH)
+            above = m['high'] / (m['mid'] + 1) > min(thresh[T_RATIO_SSH], 5.0)
         
-        self.apply_keys(up, down, left, right)
+        keys, status = GAME_ACTIONS[(m['vol'] > thresh[T_SILENCE]) | (has_pitch << 1) | (above << 2)]
+        self.apply_keys(keys)
         return status
 
-    def apply_keys(self, up, down, left, right):
-        keys = [(KEY_ACCEL, up), (KEY_BRAKE, down), (KEY_LEFT, left), (KEY_RIGHT, right)]
-        for k, s in keys:
-            if s and not self.pressed[k]:
-                pydirectinput.keyDown(k); self.pressed[k]=True
-            elif not s and self.pressed[k]:
-                pydirectinput.keyUp(k); self.pressed[k]=False
+    def apply_keys(self, target):
+        diff = target ^ self.pressed_bits
+        if diff: send_key_changes(target, diff) # Only keys whose state changed
+        self.pressed_bits = target
     
     def release_all_keys(self):
-        for k in self.pressed:
-            if self.pressed[k]:
-                pydirectinput.keyUp(k)
-                self.pressed[k] = False
+        if self.pressed_bits:
+            send_key_changes(0, self.pressed_bits)
+            self.pressed_bits = 0
 
     def stop_stream(self):
         self.release_all_keys()
@@ -240,12 +368,9 @@ class MainWindow(QMainWindow):
         self.setWindowTitle("DSP Voice Controller - Ultimate UI")
         self.resize(500, 950)
 
-        # Worker Thread
-        self.worker = AudioWorker()
-        self.worker.update_plots.connect(self.update_graphs)
-        self.worker.update_status.connect(self.update_status_label)
-        self.worker.calibration_progress.connect(self.update_calib_progress)
-        self.worker.calibration_finished.connect(self.on_calib_step_complete)
+        # Worker Process (started once a device is picked); device list from one PyAudio for the window
+        self.new_worker()
+        self.pa = pyaudio.PyAudio()
 
         # --- CENTRAL WIDGET ---
         central_widget = QWidget()
@@ -269,6 +394,12 @@ class MainWindow(QMainWindow):
         self.refresh_devices()
         self.stack.setCurrentIndex(0)
 
+        # Redraw at a fixed rate from the newest chunk instead of once per audio chunk
+        self._last_status = None
+        self.ui_timer = QTimer(self)
+        self.ui_timer.timeout.connect(self.poll_worker)
+        self.ui_timer.start(UI_REFRESH_MS)
+
     def setup_graphs(self):
         # Raw
         self.main_layout.addWidget(QLabel("Raw Input (Time Domain)"))
@@ -346,23 +477,39 @@ class MainWindow(QMainWindow):
 
         self.stack.addWidget(self.page_game)
 
+    def new_worker(self):
+        """Creates an unstarted worker and maps its plot block (a process can only be started once)."""
+        self.worker = AudioWorker()
+        self._plots = np.ndarray((PLOT_LEN,), dtype=np.float32, buffer=self.worker.plot_shm.buf)
+        self._last_seq = 0
+        self._last_calib_seq = 0
+
+    def release_worker(self):
+        """Stops the worker (it releases its keys on the way out) and frees its plot block."""
+        self.worker.running.value = False
+        if self.worker.is_alive():
+            self.worker.join()
+        del self._plots
+        self.worker.plot_shm.close()
+        self.worker.plot_shm.unlink()
+
     def refresh_devices(self):
-        p = pyaudio.PyAudio()
         self.combo_devices.clear()
-        for i in range(p.get_device_count()):
-            info = p.get_device_info_by_index(i)
+        for i in range(self.pa.get_device_count()):
+            info = self.pa.get_device_info_by_index(i)
             if info['maxInputChannels'] > 0:
                 self.combo_devices.addItem(f"{info['index']}: {info['name']}", info['index'])
-        p.terminate()
 
     # --- LOGIC FLOW ---
 
     def start_calibration_sequence(self):
-        # User picked device, start thread
+        # User picked device, start the worker process
         idx = self.combo_devices.currentData()
+        if self.worker.pid is not None: # Started before (R reset): the new device needs a new process
+            self.release_worker()
+            self.new_worker()
         self.worker.set_device(idx)
-        if not self.worker.isRunning():
-            self.worker.start()
+        self.worker.start()
         
         self.stack.setCurrentIndex(1) # Show Calib Screen
         self.calib_stage = 0
@@ -390,9 +537,9 @@ class MainWindow(QMainWindow):
     def trigger_calib_step(self):
         self.btn_calib_action.setEnabled(False)
         self.btn_calib_action.setText("MEASURING...")
-        self.worker.start_calibration_step(self.calib_stage)
+        self.worker.start_calibration_step()
 
-    def update_calib_progress(self, val, msg):
+    def update_calib_progress(self, val):
         self.progress_calib.setValue(val)
 
     def on_calib_step_complete(self, data):
@@ -400,8 +547,8 @@ class MainWindow(QMainWindow):
         stage = self.calib_stage
         
         if stage == 0: # Silence
-            self.worker.thresh['silence'] = max(data['vol'] * 2.0, 500)
-            print(f"Silence Floor: {self.worker.thresh['silence']}")
+            self.worker.thresh[T_SILENCE] = max(data['vol'] * 2.0, 500)
+            print(f"Silence Floor: {self.worker.thresh[T_SILENCE]}")
         
         elif stage == 1: # OOO
             self.calib_o_pitch = data['pitch']
@@ -410,49 +557,68 @@ class MainWindow(QMainWindow):
         elif stage == 2: # EEE
             # Set Pitch Thresh
             avg_pitch = min(self.calib_o_pitch, data['pitch'])
-            self.worker.thresh['pitch'] = avg_pitch * 0.4
+            self.worker.thresh[T_PITCH] = avg_pitch * 0.4
             
             # Set O/E Boundary
-            self.worker.thresh['ratio_oe'] = (self.calib_o_ratio + data['r_oe']) / 2
-            print(f"Pitch Gate: {self.worker.thresh['pitch']} | OE Split: {self.worker.thresh['ratio_oe']}")
+            self.worker.thresh[T_RATIO_OE] = (self.calib_o_ratio + data['r_oe']) / 2
+            print(f"Pitch Gate: {self.worker.thresh[T_PITCH]} | OE Split: {self.worker.thresh[T_RATIO_OE]}")
 
         elif stage == 3: # SHH
             self.calib_sh_ratio = data['r_ssh']
 
         elif stage == 4: # SSS
-            self.worker.thresh['ratio_ssh'] = (self.calib_sh_ratio + data['r_ssh']) / 2
-            print(f"S/SH Split: {self.worker.thresh['ratio_ssh']}")
+            self.worker.thresh[T_RATIO_SSH] = (self.calib_sh_ratio + data['r_ssh']) / 2
+            print(f"S/SH Split: {self.worker.thresh[T_RATIO_SSH]}")
 
         elif stage == 5: # CLAP
             # --- FIX IS HERE ---
             # We use 'max_vol' (Peak) instead of 'vol' (Average)
             # This ensures the threshold is set to the loudness of the clap itself,
             # not the silence that came after it.
-            self.worker.thresh['respawn'] = data['max_vol'] * 0.8
-            print(f"Clap Thresh: {self.worker.thresh['respawn']}")
+            self.worker.thresh[T_RESPAWN] = data['max_vol'] * 0.8
+            print(f"Clap Thresh: {self.worker.thresh[T_RESPAWN]}")
 
         self.calib_stage += 1
         self.next_calib_stage()
         
     def finish_calibration(self):
-        self.worker.mode = 'GAME'
+        self.worker.mode.value = MODE_GAME
         self.stack.setCurrentIndex(2) # Go to Game Screen
 
     def reset_program(self):
-        self.worker.mode = 'IDLE'
-        self.worker.release_all_keys()
+        self.worker.mode.value = MODE_IDLE # The worker releases its keys outside game mode
         self.stack.setCurrentIndex(0) # Back to device select
         self.refresh_devices()
 
     # --- UI UPDATES ---
 
+    def poll_worker(self):
+        worker = self.worker
+        if worker.mode.value == MODE_CALIBRATING:
+            self.update_calib_progress(int((worker.calib_n.value / worker.calib_target_samples) * 100))
+        calib_seq = worker.calib_seq.value
+        if calib_seq != self._last_calib_seq:
+            self._last_calib_seq = calib_seq
+            self.on_calib_step_complete(dict(zip(CALIB_FIELDS, worker.calib_result)))
+
+        seq = worker.plot_seq.value
+        if seq == self._last_seq: return
+        self._last_seq = seq
+        with worker.plot_lock:
+            data = self._plots.copy() # pyqtgraph keeps the arrays it's given
+            text = worker.status.value.decode()
+        self.update_graphs(data[:PLOT_N], data[PLOT_N:2*PLOT_N], data[2*PLOT_N:])
+        if text != self._last_status:
+            self._last_status = text
+            self.update_status_label(text)
+
     def update_graphs(self, raw, filt, fft):
         self.curve_raw.setData(raw)
         self.curve_filt.setData(filt)
-        self.curve_fft.setData(fft[:300])
+        self.curve_fft.setData(fft)
 
-    def update_status_label(self, text, vol, pitch):
-        if self.worker.mode == 'GAME':
+    def update_status_label(self, text):
+        if self.worker.mode.value == MODE_GAME:
             self.lbl_status.setText(text)
             # Simple color coding
             color = "#333"
@@ -463,14 +629,21 @@ class MainWindow(QMainWindow):
 
     def keyPressEvent(self, event):
         if event.key() == Qt.Key.Key_Escape:
-            self.worker.running = False
             self.close()
         elif event.key() == Qt.Key.Key_Space:
-            self.worker.paused = not self.worker.paused
-            self.lbl_status.setText("PAUSED" if self.worker.paused else "RESUMED")
+            self.worker.paused.value = not self.worker.paused.value
+            self.lbl_status.setText("PAUSED" if self.worker.paused.value else "RESUMED")
+            self._last_status = None # Repaint the worker's status on the next poll
         elif event.key() == Qt.Key.Key_R:
             self.reset_program()
 
+    def closeEvent(self, event):
+        # ESC or the window's X: stop the worker cleanly so its keys are released, then free shared resources
+        self.ui_timer.stop()
+        self.release_worker()
+        self.pa.terminate()
+        super().closeEvent(event)
+
 if __name__ == "__main__":
     app = QApplication(sys.argv)
     window = MainWindow()
@@ -1,9 +1,13 @@
 import sys
 import time
+import threading
 import numpy as np
 import pyaudio
 import pydirectinput
+import ctypes
 from scipy import signal
+from scipy.fft import rfft
+from numba import njit
 from collections import deque
 
 from PyQt6.QtWidgets import (
@@ -30,11 +34,95 @@ KEY_LEFT = 'a'
 KEY_RIGHT = 'd'
 KEY_RESPAWN = 'q'
 
+# Held-key state as a bitmask: bit i <-> _KEY_ORDER[i]
+_KEY_ORDER = (KEY_ACCEL, KEY_BRAKE, KEY_LEFT, KEY_RIGHT)
+# Keys held for each action, as _KEY_ORDER bits
+ACTION_KEYS = {'LEFT': 0b0101, 'RIGHT': 0b1001, 'GAS': 0b0001, 'BRAKE': 0b0010, 'IDLE': 0}
+
+# =====================
+# KEY OUTPUT
+# =====================
+# Changed keys go out in one SendInput call per frame, built from pydirectinput's own
+# scancode table and INPUT structures (arrow keys need the extended-key flag)
+_KEY_SCAN = tuple((pydirectinput.KEYBOARD_MAPPING[k],
+                   pydirectinput.KEYEVENTF_SCANCODE |
+                   (pydirectinput.KEYEVENTF_EXTENDEDKEY if k in ('up', 'down', 'left', 'right') else 0))
+                  for k in _KEY_ORDER)
+_INPUTS = (pydirectinput.Input * len(_KEY_ORDER))()
+_EXTRA = ctypes.c_ulong(0)
+for _inp in _INPUTS:
+    _inp.type = 1 # INPUT_KEYBOARD
+    _inp.ii.ki.dwExtraInfo = ctypes.pointer(_EXTRA)
+
+def send_key_changes(target, diff):
+    """Presses/releases every key set in `diff` (state taken from `target`) with a single SendInput."""
+    n = 0
+    while diff:
+        bit = diff & -diff
+        scan, flags = _KEY_SCAN[bit.bit_length() - 1]
+        ki = _INPUTS[n].ii.ki
+        ki.wScan = scan
+        ki.dwFlags = flags if target & bit else flags | pydirectinput.KEYEVENTF_KEYUP
+        n += 1
+        diff ^= bit
+    pydirectinput.SendInput(n, _INPUTS, ctypes.sizeof(pydirectinput.Input))
+
+# =====================
+# DSP KERNELS (Numba)
+# =====================
+@njit(cache=True, fastmath=True)
+def _prep(samples, gain, sos, zi, window, filtered, windowed):
+    """
+    One pass over the int16 chunk: applies the gain, runs the high-pass biquad cascade
+    (Direct Form II transposed, per-section delays kept in `zi` across chunks) and fills
+    `filtered` and its windowed copy `windowed` for the FFT.
+    Returns the RMS of filtered.
+    """
+    n = samples.shape[0]
+    n_sections = sos.shape[0]
+    sum_sq = 0.0
+    for i in range(n):
+        v = np.float32(samples[i]) * gain
+        for s in range(n_sections):
+            out = sos[s, 0] * v + zi[s, 0]
+            zi[s, 0] = sos[s, 1] * v - sos[s, 4] * out + zi[s, 1]
+            zi[s, 1] = sos[s, 2] * v - sos[s, 5] * out
+            v = out
+        filtered[i] = v
+        sum_sq += v * v
+        windowed[i] = v * window[i]
+    return np.sqrt(sum_sq / n)
+
+@njit(cache=True, fastmath=True)
+def _smooth(hist, hist_n, vol, pitch, low, mid, high, scratch, med):
+    """
+    Stores write number `hist_n` of (vol, pitch, low, mid, high) in the `hist` ring and fills
+    `med` with each feature's median over the filled slots (the upper one while fewer than
+    SMOOTH_WIN are filled), insertion-sorting each row in `scratch`.
+    """
+    win = hist.shape[1]
+    slot = hist_n % win
+    hist[0, slot] = vol
+    hist[1, slot] = pitch
+    hist[2, slot] = low
+    hist[3, slot] = mid
+    hist[4, slot] = high
+    n = min(hist_n + 1, win)
+    for f in range(5):
+        for i in range(n):
+            v = hist[f, i]
+            j = i
+            while j > 0 and scratch[j - 1] > v:
+                scratch[j] = scratch[j - 1]
+                j -= 1
+            scratch[j] = v
+        med[f] = scratch[n // 2]
+
 # =====================
 # AUDIO THREAD
 # =====================
 class AudioWorker(QThread):
-    update_data = pyqtSignal(dict)
+    update_data = pyqtSignal(int)  # ui_seq; the frame itself is read from the ui_* buffers
     calib_progress = pyqtSignal(int)
     calib_done = pyqtSignal(dict)
 
@@ -46,14 +134,45 @@ class AudioWorker(QThread):
 
         self.p = pyaudio.PyAudio()
         self.stream = None
+        self._frames = deque(maxlen=4) # Chunks pushed by the PortAudio callback
+        self._frame_ready = threading.Event()
+
+        self.hp = signal.butter(8, 100, 'hp', fs=RATE, output='sos').astype(np.float32)
+        # Filter state carried across chunks, starting at rest
+        self.hp_zi = np.zeros((self.hp.shape[0], 2), dtype=np.float32)
+        # DSP runs in float32 throughout
+        self.gain = np.float32(GAIN)
+        # FFT window (CHUNK is fixed)
+        self.window = np.hamming(CHUNK).astype(np.float32)
+        # Per-chunk buffers reused every chunk
+        self._filtered = np.empty(CHUNK, dtype=np.float32)
+        self._windowed = np.empty(CHUNK, dtype=np.float32)
+        self._fft_mag = np.empty(CHUNK//2 + 1, dtype=np.float32)
+        # Pitch, Low, Mid, High bands as FFT bin edges for one np.add.reduceat pass
+        bin_hz = RATE/CHUNK
+        bands = [(int(lo/bin_hz), int(hi/bin_hz))
+                 for lo, hi in ((100, 300), (300, 800), (2000, 4000), (5000, 10000))]
+        edges = sorted({i for band in bands for i in band})
+        self._band_edges = np.array(edges)
+        self._band_slots = np.array([edges.index(lo) for lo, _ in bands])
+        # Compile the chunk kernel now instead of on the first chunk
+        _prep(np.zeros(CHUNK, dtype=np.int16), self.gain, self.hp, self.hp_zi,
+              self.window, self._filtered, self._windowed)
+        # pocketfft caches its plan per length/dtype; build the CHUNK float32 plan up front
+        rfft(self._windowed)
+
+        # Last SMOOTH_WIN feature rows (vol, pitch, low, mid, high) as a ring; hist_n counts writes
+        self.hist = np.zeros((5, SMOOTH_WIN), dtype=np.float32)
+        self.hist_n = 0
+        self._sort_buf = np.empty(SMOOTH_WIN, dtype=np.float32)
+        self._med = np.empty(5, dtype=np.float32)  # Smoothed (vol, pitch, low, mid, high)
+        # Compile now; writing zeros over slot 0 of the empty ring changes nothing
+        _smooth(self.hist, 0, 0.0, 0.0, 0.0, 0.0, 0.0, self._sort_buf, self._med)
 
-        self.hp = signal.butter(8, 100, 'hp', fs=RATE, output='sos')
-
-        self.hist = {k: deque(maxlen=SMOOTH_WIN)
-                     for k in ['vol','pitch','low','mid','high']}
-
-        self.calib_buf = []
         self.calib_target = 60
+        # One (vol, pitch, low, mid, high) row per calibration chunk; calib_n rows filled
+        self.calib_buf = np.empty((self.calib_target, 5), dtype=np.float32)
+        self.calib_n = 0
         self.calib_step = 0
 
         self.thresh = {
@@ -66,16 +185,23 @@ class AudioWorker(QThread):
 
         self.last_action = 'IDLE'
         self.last_time = 0
+        self.last_emit = 0  # update_data is sent at most once per UI_REFRESH_MS
+        # Latest published frame, overwritten in place; update_data carries only ui_seq
+        self.ui_levels = np.zeros(5, dtype=np.float32)  # vol, pitch, low, mid, high
+        self.ui_raw = np.zeros(CHUNK, dtype=np.float32)
+        self.ui_fft = np.zeros(CHUNK//2 + 1, dtype=np.float32)
+        self.ui_action = 'IDLE'
+        self.ui_seq = 0
+        self.debug_spectrum = False  # Also publish ui_raw/ui_fft (only a scope/spectrum view needs them)
 
-        self.pressed = {KEY_ACCEL:False, KEY_BRAKE:False,
-                        KEY_LEFT:False, KEY_RIGHT:False}
+        self.pressed_bits = 0  # Currently held keys (see _KEY_ORDER)
 
     def set_device(self, idx):
         self.device = idx
 
     def start_calibration(self, step):
         self.calib_step = step
-        self.calib_buf.clear()
+        self.calib_n = 0
         self.mode = 'CALIB'
 
     def run(self):
@@ -85,115 +211,126 @@ class AudioWorker(QThread):
             rate=RATE,
             input=True,
             input_device_index=self.device,
-            frames_per_buffer=CHUNK
+            frames_per_buffer=CHUNK,
+            stream_callback=self._on_audio
         )
 
         while self.running:
-            data = self.stream.read(CHUNK, exception_on_overflow=False)
-            audio = np.frombuffer(data, dtype=np.int16).astype(np.float64) * GAIN
-            audio = signal.sosfilt(self.hp, audio)
-
-            vol = np.sqrt(np.mean(audio**2))
-            fft = np.abs(np.fft.rfft(audio * np.hamming(len(audio))))
-
-            def band(lo, hi):
-                return np.sum(fft[int(lo/(RATE/CHUNK)):int(hi/(RATE/CHUNK))])
-
-            m = {
-                'vol': vol,
-                'pitch': band(100,300),
-                'low': band(300,800),
-                'mid': band(2000,4000),
-                'high': band(5000,10000),
-                'raw': audio,
-                'fft': fft
-            }
+            try:
+                data = self._next_frame()
+            except IOError as e:
+                print(f"Stream Error: {e}")
+                break
+            if data is None: break
+            # Gain, high-pass, volume and FFT window in one pass
+            vol = _prep(np.frombuffer(data, dtype=np.int16), self.gain,
+                        self.hp, self.hp_zi, self.window, self._filtered, self._windowed)
+            fft = np.abs(rfft(self._windowed), out=self._fft_mag)
+            pitch, low, mid, high = np.add.reduceat(fft, self._band_edges)[self._band_slots]
 
             if self.mode == 'CALIB':
-                self.calib_buf.append(m)
+                self.calib_buf[self.calib_n] = (vol, pitch, low, mid, high)
+                self.calib_n += 1
                 self.calib_progress.emit(
-                    int(100 * len(self.calib_buf) / self.calib_target)
+                    int(100 * self.calib_n / self.calib_target)
                 )
-                if len(self.calib_buf) >= self.calib_target:
+                if self.calib_n >= self.calib_target:
                     self.finish_calibration()
                 continue
 
-            for k in self.hist:
-                self.hist[k].append(m[k])
-
-            sm = {k: np.median(self.hist[k]) for k in self.hist}
-            action = self.decide(sm)
+            # Ring update and per-feature medians in one native call
+            _smooth(self.hist, self.hist_n, vol, pitch, low, mid, high, self._sort_buf, self._med)
+            self.hist_n += 1
+            action = self.decide(*self._med)
             self.apply_keys(action)
 
-            m['action'] = action
-            self.update_data.emit(m)
+            now = time.time()
+            if now - self.last_emit >= UI_REFRESH_MS / 1000:
+                self.last_emit = now
+                self.ui_levels[:] = (vol, pitch, low, mid, high)
+                if self.debug_spectrum:
+                    np.copyto(self.ui_raw, self._filtered)
+                    np.copyto(self.ui_fft, fft)
+                self.ui_action = action
+                self.ui_seq += 1
+                self.update_data.emit(self.ui_seq)
 
         self.cleanup()
 
+    def _on_audio(self, in_data, frame_count, time_info, status):
+        # Runs on PortAudio's thread: just hand the chunk over
+        self._frames.append(in_data)
+        self._frame_ready.set()
+        return (None, pyaudio.paContinue)
+
+    def _next_frame(self):
+        """
+        Waits for the next chunk from the callback, dropping stale ones to avoid input lag.
+        Returns None once running is cleared; raises IOError after 1 s without audio.
+        """
+        deadline = time.monotonic() + 1.0
+        while not self._frames:
+            if not self.running:
+                return None
+            # Short waits so a stop request is seen within 0.1 s
+            if self._frame_ready.wait(0.1):
+                self._frame_ready.clear()
+            elif time.monotonic() > deadline:
+                raise IOError("No audio from input stream")
+        while len(self._frames) > 1:
+            self._frames.popleft()
+        return self._frames.popleft()
+
     def finish_calibration(self):
-        vols = [x['vol'] for x in self.calib_buf]
-        pitch = np.median([x['pitch'] for x in self.calib_buf])
-        r_oe = np.median([x['mid']/(x['low']+1) for x in self.calib_buf])
-        r_ssh = np.median([x['high']/(x['mid']+1) for x in self.calib_buf])
+        vols, pitch, low, mid, high = self.calib_buf[:self.calib_n].T
+        r_oe = np.median(mid/(low+1))
+        r_ssh = np.median(high/(mid+1))
 
         self.mode = 'IDLE'
         self.calib_done.emit({
             'step': self.calib_step,
             'vol': np.mean(vols),
             'max_vol': np.max(vols),
-            'pitch': pitch,
+            'pitch': np.median(pitch),
             'r_oe': r_oe,
             'r_ssh': r_ssh
         })
 
-    def decide(self, m):
+    def decide(self, vol, pitch, low, mid, high):
         now = time.time()
         if now - self.last_time < DECISION_HOLD:
             return self.last_action
 
-        if m['vol'] > self.thresh['clap']:
+        if vol > self.thresh['clap']:
             self.last_action = 'RESPAWN'
             self.last_time = now
             return 'RESPAWN'
 
-        if m['vol'] < self.thresh['silence']:
+        if vol < self.thresh['silence']:
             return 'IDLE'
 
-        if m['pitch'] > self.thresh['pitch']:
-            act = 'LEFT' if m['mid']/(m['low']+1) > self.thresh['ratio_oe'] else 'RIGHT'
+        if pitch > self.thresh['pitch']:
+            act = 'LEFT' if mid/(low+1) > self.thresh['ratio_oe'] else 'RIGHT'
         else:
-            act = 'GAS' if m['high']/(m['mid']+1) > self.thresh['ratio_ssh'] else 'BRAKE'
+            act = 'GAS' if high/(mid+1) > self.thresh['ratio_ssh'] else 'BRAKE'
 
         self.last_action = act
         self.last_time = now
         return act
 
     def apply_keys(self, act):
-        mapping = {
-            'LEFT': (True,False,True,False),
-            'RIGHT': (True,False,False,True),
-            'GAS': (True,False,False,False),
-            'BRAKE': (False,True,False,False),
-            'IDLE': (False,False,False,False)
-        }
-
         if act == 'RESPAWN':
             pydirectinput.press(KEY_RESPAWN)
             return
 
-        up, down, left, right = mapping.get(act,(0,0,0,0))
-        for k, s in zip([KEY_ACCEL,KEY_BRAKE,KEY_LEFT,KEY_RIGHT],
-                        [up,down,left,right]):
-            if s and not self.pressed[k]:
-                pydirectinput.keyDown(k)
-                self.pressed[k]=True
-            elif not s and self.pressed[k]:
-                pydirectinput.keyUp(k)
-                self.pressed[k]=False
+        target = ACTION_KEYS.get(act, 0)
+        diff = target ^ self.pressed_bits
+        if diff: send_key_changes(target, diff)  # Only keys whose state changed
+        self.pressed_bits = target
 
     def cleanup(self):
-        for k in self.pressed:
-            if self.pressed[k]:
-                pydirectinput.keyUp(k)
+        if self.pressed_bits:
+            send_key_changes(0, self.pressed_bits)
+            self.pressed_bits = 0
         self.stream.close()
         self.p.terminate()
@@ -1,10 +1,13 @@
 import pyaudio
 import numpy as np
+from scipy.fft import rfft
+from numba import njit
 import pydirectinput
 import time
 import threading
 import tkinter as tk
 from tkinter import ttk, messagebox
+from collections import deque
 
 # --- CONFIGURATION ---
 CHUNK = 1024
@@ -12,6 +15,7 @@ FORMAT = pyaudio.paInt16
 CHANNELS = 1
 RATE = 44100
 GAIN = 5.0
+UI_REFRESH_MS = 50  # Dashboard redraw period (20 Hz), independent of the audio rate
 
 # CONTROLS
 KEY_ACCEL = 'up'
@@ -20,18 +24,35 @@ KEY_LEFT = 'left'
 KEY_RIGHT = 'right'
 KEY_RESPAWN = 'enter'
 
+# Held-key state as a bitmask: bit i <-> _KEY_ORDER[i]
+_KEY_ORDER = (KEY_ACCEL, KEY_BRAKE, KEY_LEFT, KEY_RIGHT)
+
+# --- DSP KERNELS (Numba) ---
+@njit(cache=True, fastmath=True)
+def _prep(samples, window, windowed):
+    """One pass over the int16 chunk: fills `windowed` for the FFT and returns the chunk's RMS."""
+    acc = np.float32(0.0)
+    for i in range(samples.shape[0]):
+        x = np.float32(samples[i])
+        acc += x * x
+        windowed[i] = x * window[i]
+    return np.sqrt(acc / samples.shape[0])
+
 class AudioProcessor:
     """Handles the heavy lifting: Audio analysis and Key pressing in a separate thread."""
-    def __init__(self, callback_update_ui):
+    def __init__(self):
         self.p = pyaudio.PyAudio()
         self.stream = None
         self.running = False
         self.calibrating = False
         
         self.device_index = None
-        self.callback_update_ui = callback_update_ui
+        self.latest_ui = None  # Newest dashboard data, polled by the UI thread
+        self._frames = deque(maxlen=4) # Chunks pushed by the PortAudio callback
+        self._frame_ready = threading.Event()
+        self._loop_thread = None # process_loop's thread, joined before another one starts
         
-        self.pressed = {'up':False, 'down':False, 'left':False, 'right':False, 'enter':False}
+        self.pressed_bits = 0 # Currently held keys (see _KEY_ORDER)
         
         # Thresholds (Default)
         self.silence_thresh = 500
@@ -40,6 +61,21 @@ class AudioProcessor:
         self.ratio_oe = 1.5 
         self.ratio_ssh = 3.0
 
+        # FFT window with GAIN folded in (CHUNK is fixed), so the chunk is scaled and windowed in one multiply
+        self._window = (np.hamming(CHUNK) * GAIN).astype(np.float32)
+        self._windowed = np.zeros(CHUNK, dtype=np.float32)
+        self._fft_mag = np.empty(CHUNK//2 + 1, dtype=np.float32) # Reused every chunk
+        # Compile the chunk kernel now instead of on the first chunk
+        _prep(np.zeros(CHUNK, dtype=np.int16), self._window, self._windowed)
+        # pocketfft caches its plan per length/dtype; build the CHUNK float32 plan up front
+        rfft(self._windowed)
+        # Pitch, Low, Mid, High bands as FFT bin edges for one np.add.reduceat pass
+        bin_hz = RATE / CHUNK
+        bands = [(int(lo/bin_hz), int(hi/bin_hz)) for lo, hi in ((100, 300), (300, 800), (2000, 4000), (5000, 10000))]
+        edges = sorted({i for band in bands for i in band})
+        self._band_edges = np.array(edges)
+        self._band_slots = np.array([edges.index(lo) for lo, _ in bands])
+
     def get_devices(self):
         devices = []
         info = self.p.get_host_api_info_by_index(0)
@@ -52,18 +88,47 @@ class AudioProcessor:
 
     def start(self, device_index):
         if self.running: return
+        if self._loop_thread is not None:
+            self._loop_thread.join()
+            self._loop_thread = None
+        self._frames.clear()
         self.device_index = device_index
         try:
             self.stream = self.p.open(format=FORMAT, channels=CHANNELS, rate=RATE, input=True,
-                                      input_device_index=self.device_index, frames_per_buffer=CHUNK)
+                                      input_device_index=self.device_index, frames_per_buffer=CHUNK,
+                                      stream_callback=self._on_audio)
             self.running = True
-            threading.Thread(target=self.process_loop, daemon=True).start()
+            self._loop_thread = threading.Thread(target=self.process_loop, daemon=True)
+            self._loop_thread.start()
         except Exception as e:
             print(f"Error starting stream: {e}")
             self.running = False
 
+    def _on_audio(self, in_data, frame_count, time_info, status):
+        # Runs on PortAudio's thread: just hand the chunk over
+        self._frames.append(in_data)
+        self._frame_ready.set()
+        return (None, pyaudio.paContinue)
+
+    def _next_frame(self):
+        """Waits for the next chunk from the callback, dropping stale ones to avoid input lag. Returns None once stopped."""
+        while not self._frames:
+            if not self.running:
+                return None
+            if not self._frame_ready.wait(1.0):
+                raise IOError("No audio from input stream")
+            self._frame_ready.clear()
+        while len(self._frames) > 1:
+            self._frames.popleft()
+        return self._frames.popleft()
+
     def stop(self):
         self.running = False
+        self._frame_ready.set() # Wake the loop if it is waiting for audio
+        if self._loop_thread is not None: # Let it finish its frame before keys and stream are released
+            self._loop_thread.join()
+            self._loop_thread = None
+        self.latest_ui = None
         # Release all keys
         self.apply_keys(False, False, False, False)
         if self.stream:
@@ -72,39 +137,50 @@ class AudioProcessor:
                 self.stream.close()
             except: pass
 
+    def get_chunk(self):
+        """Newest raw chunk as int16 samples, or None if the stream has stalled or been stopped."""
+        try:
+            data = self._next_frame()
+        except IOError:
+            return None
+        return None if data is None else np.frombuffer(data, dtype=np.int16)
+
+    def batch_spectrum(self, pcm):
+        """(rms, pitch, low, mid, high) rows for an (N, CHUNK) int16 block, via one batched rfft."""
+        audio = pcm.astype(np.float32)
+        rms = np.sqrt(np.einsum('ij,ij->i', audio, audio) / CHUNK) * GAIN
+        mag = np.abs(rfft(audio * self._window, axis=1, overwrite_x=True))
+        bands = np.add.reduceat(mag, self._band_edges, axis=1)[:, self._band_slots]
+        return np.column_stack((rms, bands))
+
     def get_spectrum(self):
+        """Returns (rms, pitch, low, mid, high); zeros if the stream stalls, None once stopped."""
         try:
-            data = self.stream.read(CHUNK, exception_on_overflow=False)
-            audio = np.frombuffer(data, dtype=np.int16).astype(np.float64) * GAIN
-            
-            rms = np.sqrt(np.mean(audio**2))
-            window = np.hamming(len(audio))
-            fft = np.fft.rfft(audio * window)
-            mag = np.abs(fft)
-            
-            # Helper to get energy in freq range
-            def get_band(low, high):
-                idx_l = int(low/(RATE/CHUNK))
-                idx_h = int(high/(RATE/CHUNK))
-                return np.sum(mag[idx_l:idx_h])
-
-            # Bands
-            e_pitch = get_band(100, 300)
-            e_low   = get_band(300, 800)
-            e_mid   = get_band(2000, 4000)
-            e_high  = get_band(5000, 10000)
-            
-            return rms, e_pitch, e_low, e_mid, e_high
-        except:
+            data = self._next_frame()
+        except IOError:
             return 0,0,0,0,0
+        if data is None:
+            return None
+        # Volume and gain/FFT window in one pass
+        rms = _prep(np.frombuffer(data, dtype=np.int16), self._window, self._windowed) * GAIN
+        # _windowed is rewritten by _prep every chunk, so the FFT may clobber it
+        mag = np.abs(rfft(self._windowed, overwrite_x=True), out=self._fft_mag)
+        
+        # Bands
+        e_pitch, e_low, e_mid, e_high = np.add.reduceat(mag, self._band_edges)[self._band_slots]
+        
+        return rms, e_pitch, e_low, e_mid, e_high
 
     def apply_keys(self, up, down, left, right):
-        keys = [(KEY_ACCEL, up), (KEY_BRAKE, down), (KEY_LEFT, left), (KEY_RIGHT, right)]
-        for k, s in keys:
-            if s and not self.pressed[k]:
-                pydirectinput.keyDown(k); self.pressed[k]=True
-            elif not s and self.pressed[k]:
-                pydirectinput.keyUp(k); self.pressed[k]=False
+        target = up | (down << 1) | (left << 2) | (right << 3)
+        diff = target ^ self.pressed_bits
+        while diff: # Only keys whose state changed
+            bit = diff & -diff
+            k = _KEY_ORDER[bit.bit_length() - 1]
+            if target & bit: pydirectinput.keyDown(k)
+            else: pydirectinput.keyUp(k)
+            diff ^= bit
+        self.pressed_bits = target
 
     def process_loop(self):
         while self.running:
@@ -112,7 +188,9 @@ class AudioProcessor:
                 time.sleep(0.1)
                 continue
 
-            vol, e_pitch, e_low, e_mid, e_high = self.get_spectrum()
+            spec = self.get_spectrum()
+            if spec is None: break
+            vol, e_pitch, e_low, e_mid, e_high = spec
             up, down, left, right = False, False, False, False
             status_text = "Idle"
             
@@ -153,7 +231,7 @@ class AudioProcessor:
                 'status': status_text,
                 'keys': (up, down, left, right)
             }
-            self.callback_update_ui(ui_data)
+            self.latest_ui = ui_data
 
 
 class VoiceApp(tk.Tk):
@@ -165,7 +243,8 @@ class VoiceApp(tk.Tk):
         self.resizable(False, False)
         
         # Logic
-        self.processor = AudioProcessor(self.update_dashboard)
+        self.processor = AudioProcessor()
+        self._last_ui = None
         
         # Styles
         style = ttk.Style()
@@ -174,6 +253,7 @@ class VoiceApp(tk.Tk):
         style.configure("TButton", background="#444444", foreground="white")
         
         self.create_widgets()
+        self.after(UI_REFRESH_MS, self._poll_ui)
         
     def create_widgets(self):
         # 1. Header & Device Selection
@@ -262,11 +342,13 @@ class VoiceApp(tk.Tk):
             self.btn_calib.config(state="normal")
             self.reset_ui()
 
-    def update_dashboard(self, data):
-        # Note: This is called from the thread. 
-        # Tkinter isn't thread safe, but setting simple widget values often works.
-        # Ideally, we queue this, but for this complexity, we'll direct set or use after.
-        self.after(0, lambda: self._update_ui_safe(data))
+    def _poll_ui(self):
+        # Redraw at a fixed rate from the newest frame instead of once per audio chunk
+        data = self.processor.latest_ui
+        if data is not None and data is not self._last_ui:
+            self._last_ui = data
+            self._update_ui_safe(data)
+        self.after(UI_REFRESH_MS, self._poll_ui)
 
     def _update_ui_safe(self, data):
         # 1. Bars
@@ -354,44 +436,55 @@ class VoiceApp(tk.Tk):
             lbl_instr.config(text="RECORDING...", fg="#00ff00")
             top.update()
             
-            # Record 2 seconds
-            data_points = []
+            # Record 2 seconds of raw chunks, then analyse them in one batch; extra chunks beyond the audio rate are dropped
+            pcm, n = np.empty((int(2.0 * RATE / CHUNK) + 4, CHUNK), dtype=np.int16), 0
             st = time.time()
             while time.time() - st < 2.0:
-                data_points.append(self.processor.get_spectrum())
+                chunk = self.processor.get_chunk()
+                if chunk is not None and n < len(pcm):
+                    pcm[n] = chunk; n += 1
                 pb['value'] = ((time.time() - st) / 2.0) * 100
                 top.update()
             
-            results[name] = data_points
+            if n == 0: # The stream gave nothing for the whole step; the thresholds can't be derived
+                abort_calibration(f"No audio was recorded during the {name} step.")
+                return
+            results[name] = self.processor.batch_spectrum(pcm[:n])
             perform_step(step_index + 1)
 
+        def abort_calibration(reason):
+            self.processor.calibrating = False
+            self.processor.stop() # Stop temp stream
+            top.destroy()
+            messagebox.showerror("Calibration Failed", f"{reason}\n\nThe previous thresholds were kept.")
+
         def finish_calibration():
             # Apply Logic
             # 1. Silence
-            silence_floor = max(np.mean([x[0] for x in results["SILENCE"]]) * 2.0, 500)
+            silence_floor = max(results["SILENCE"][:, 0].mean() * 2.0, 500)
             
             # 2. Pitch Threshold (OOO vs EEE)
-            data_o = [x for x in results["OOO"] if x[0] > silence_floor]
-            data_e = [x for x in results["EEE"] if x[0] > silence_floor]
+            data_o = results["OOO"][results["OOO"][:, 0] > silence_floor]
+            data_e = results["EEE"][results["EEE"][:, 0] > silence_floor]
             
-            p_o = np.median([x[1] for x in data_o]) if data_o else 1000
-            p_e = np.median([x[1] for x in data_e]) if data_e else 1000
+            p_o = np.median(data_o[:, 1]) if len(data_o) else 1000
+            p_e = np.median(data_e[:, 1]) if len(data_e) else 1000
             pitch_thresh = min(p_o, p_e) * 0.4
             
             # 3. O/E Ratio
-            r_o = np.median([(x[3]/(x[2]+1)) for x in data_o]) if data_o else 0.5
-            r_e = np.median([(x[3]/(x[2]+1)) for x in data_e]) if data_e else 2.0
+            r_o = np.median(data_o[:, 3]/(data_o[:, 2]+1)) if len(data_o) else 0.5
+            r_e = np.median(data_e[:, 3]/(data_e[:, 2]+1)) if len(data_e) else 2.0
             ratio_oe = (r_o + r_e) / 2
             
             # 4. S/SH Ratio
             data_sh = results["SHHH"]
             data_s = results["SSSS"]
-            r_sh = np.median([(x[4]/(x[3]+1)) for x in data_sh])
-            r_s = np.median([(x[4]/(x[3]+1)) for x in data_s])
+            r_sh = np.median(data_sh[:, 4]/(data_sh[:, 3]+1))
+            r_s = np.median(data_s[:, 4]/(data_s[:, 3]+1))
             ratio_ssh = (r_sh + r_s) / 2
             
             # 5. Respawn
-            respawn = np.max([x[0] for x in results["CLAP"]]) * 0.8
+            respawn = results["CLAP"][:, 0].max() * 0.8
             
             # Save to Processor
             self.processor.silence_thresh = silence_floor
@@ -34,14 +34,22 @@ class AudioMonitorWindow(QMainWindow):
         # 3. --- Create the plot data line ---
         # This is the line object we will update
         self.data_line = self.plot_widget.plot(pen='c') # 'c' for cyan
+        # Draw at most ~2 points per screen pixel, and only the visible x range
+        self.data_line.setDownsampling(auto=True, method='peak')
+        self.data_line.setClipToView(True)
 
         # 4. --- Set up the audio stream ---
+        # The stream callback copies each new block into this preallocated buffer;
+        # the plot timer only reads it, so the GUI thread never blocks on audio
+        self._ring = np.zeros(CHUNKSIZE, dtype=np.float32)
+        self._overflowed = False
         try:
             self.stream = sd.InputStream(
                 samplerate=SAMPLERATE,
                 channels=1,         # Mono audio
                 blocksize=CHUNKSIZE,
-                dtype='float32'     # Data type of the samples
+                dtype='float32',    # Data type of the samples
+                callback=self._on_audio
             )
             self.stream.start()
         except Exception as e:
@@ -55,21 +63,26 @@ class AudioMonitorWindow(QMainWindow):
         self.timer.timeout.connect(self.update_plot)
         self.timer.start()
 
+    def _on_audio(self, indata, frames, time_info, status):
+        """
+        Runs on the audio thread for every block.
+        'indata' has a shape of (CHUNKSIZE, 1); copy its only channel into the buffer.
+        """
+        if status.input_overflow:
+            self._overflowed = True
+        self._ring[:] = indata[:, 0]
+
     def update_plot(self):
         """
         This function is called by the QTimer.
-        It reads new data from the audio stream and updates the plot.
+        It plots the newest block delivered by the audio callback.
         """
         try:
-            # Read a chunk of data from the audio stream
-            # 'data' is a numpy array. 'overflowed' is a boolean.
-            data, overflowed = self.stream.read(CHUNKSIZE)
-            
-            if overflowed:
+            if self._overflowed:
+                self._overflowed = False
                 print("Warning: Audio buffer overflowed")
 
-            # 'data' has a shape of (CHUNKSIZE, 1). We 'flatten' it to 1D.
-            self.data_line.setData(data.flatten())
+            self.data_line.setData(self._ring)
 
         except Exception as e:
             print(f"Error during audio read or plot update: {e}")
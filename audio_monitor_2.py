@@ -49,6 +49,10 @@ class AudioMonitorWindow(QMainWindow):
         self.data_line_filtered = self.plot_widget.plot(
             pen='y', name='Filtered Signal'
         )
+        # Draw at most ~2 points per screen pixel, and only the visible x range
+        for line in (self.data_line_raw, self.data_line_filtered):
+            line.setDownsampling(auto=True, method='peak')
+            line.setClipToView(True)
 
         # 4. --- NEW: Design the filter ---
         # Nyquist frequency is half the sample rate
@@ -63,12 +67,18 @@ class AudioMonitorWindow(QMainWindow):
         self.zi = lfilter_zi(self.b, self.a)
         
         # 5. --- Set up the audio stream ---
+        # The stream callback filters every block into these preallocated buffers,
+        # so no block skips the filter state; the plot timer only reads them
+        self._raw_buf = np.zeros(CHUNKSIZE, dtype=np.float32)
+        self._filt_buf = np.zeros(CHUNKSIZE, dtype=np.float32)
+        self._overflowed = False
         try:
             self.stream = sd.InputStream(
                 samplerate=SAMPLERATE,
                 channels=1,
                 blocksize=CHUNKSIZE,
-                dtype='float32'
+                dtype='float32',
+                callback=self._on_audio
             )
             self.stream.start()
         except Exception as e:
@@ -81,31 +91,35 @@ class AudioMonitorWindow(QMainWindow):
         self.timer.timeout.connect(self.update_plot)
         self.timer.start()
 
+    def _on_audio(self, indata, frames, time_info, status):
+        """
+        Runs on the audio thread for every block: stores and filters it.
+        """
+        if status.input_overflow:
+            self._overflowed = True
+        # Get the raw data (the only channel of the (CHUNKSIZE, 1) block)
+        self._raw_buf[:] = indata[:, 0]
+
+        # --- NEW: Apply the filter ---
+        # Pass in the data and the filter's previous state (self.zi)
+        # Get back the filtered data and the new state (which we save)
+        self._filt_buf[:], self.zi = lfilter(
+            self.b, self.a, self._raw_buf, zi=self.zi
+        )
+
     def update_plot(self):
         """
         This function is called by the QTimer.
-        It reads, filters, and plots the new audio data.
+        It plots the newest raw and filtered blocks from the audio callback.
         """
         try:
-            # Read a chunk of data from the audio stream
-            data, overflowed = self.stream.read(CHUNKSIZE)
-            
-            if overflowed:
+            if self._overflowed:
+                self._overflowed = False
                 print("Warning: Audio buffer overflowed")
 
-            # Get the raw data (flattened to 1D)
-            raw_data = data.flatten()
-
-            # --- NEW: Apply the filter ---
-            # Pass in the data and the filter's previous state (self.zi)
-            # Get back the filtered data and the new state (which we save)
-            filtered_data, self.zi = lfilter(
-                self.b, self.a, raw_data, zi=self.zi
-            )
-
             # --- MODIFIED: Update both plot lines ---
-            self.data_line_raw.setData(raw_data)
-            self.data_line_filtered.setData(filtered_data)
+            self.data_line_raw.setData(self._raw_buf)
+            self.data_line_filtered.setData(self._filt_buf)
 
         except Exception as e:
             print(f"Error during audio read or plot update: {e}")
@@ -1,14 +1,49 @@
 import sys
 import numpy as np
 import sounddevice as sd
+from scipy.fft import rfft
+from numba import njit
 from PyQt6.QtWidgets import QApplication, QMainWindow, QVBoxLayout, QWidget
-from PyQt6.QtCore import QTimer
+from PyQt6.QtCore import QTimer, Qt
 import pyqtgraph as pg
 
 # --- Constants ---
 SAMPLERATE = 44100      # Samples per second (standard audio rate)
 CHUNKSIZE = 1024        # Number of samples to read at a time
 APP_TITLE = "Real-Time Audio Waveform & Stats"
+FFT_SIZE = 4 * CHUNKSIZE  # Pitch FFT over the last 4 blocks (~93 ms, ~10.8 Hz bins)
+SILENCE_RMS = 0.005     # Below this loudness a block is reported unvoiced without an FFT
+PRINT_EVERY = 6         # Console stats on every 6th plotted block (~5 Hz)
+
+# --- DSP KERNELS (Numba) ---
+@njit(cache=True, fastmath=True)
+def _spectral_peak(spectrum):
+    """
+    One pass over the complex rfft output, skipping the DC bin: returns
+    (peak bin, peak power, mean power) with power = |X[k]|^2. The peak bin is
+    fractional, refined by a parabola through the log power of its neighbours.
+    """
+    peak_index = 1
+    peak_power = 0.0
+    total = 0.0
+    for k in range(1, spectrum.shape[0]):
+        c = spectrum[k]
+        p = c.real * c.real + c.imag * c.imag
+        total += p
+        if p > peak_power:
+            peak_power = p
+            peak_index = k
+    offset = 0.0
+    if peak_index + 1 < spectrum.shape[0]:
+        c = spectrum[peak_index - 1]
+        y0 = np.log(c.real * c.real + c.imag * c.imag + 1e-30)
+        y1 = np.log(peak_power + 1e-30)
+        c = spectrum[peak_index + 1]
+        y2 = np.log(c.real * c.real + c.imag * c.imag + 1e-30)
+        curve = y0 - 2.0 * y1 + y2
+        if curve < 0.0:
+            offset = 0.5 * (y0 - y2) / curve
+    return peak_index + offset, peak_power, total / (spectrum.shape[0] - 1)
 
 class AudioMonitorWindow(QMainWindow):
     def __init__(self):
@@ -33,14 +68,39 @@ class AudioMonitorWindow(QMainWindow):
 
         # 3. --- Create the plot data line ---
         self.data_line = self.plot_widget.plot(pen='c') # 'c' for cyan
+        # Draw at most ~2 points per screen pixel: per-pixel min/max ('peak') decimation
+        self.data_line.setDownsampling(auto=True, method='peak')
+        # Only process the samples inside the visible x range when zoomed in
+        self.data_line.setClipToView(True)
+        # Fixed float32 sample axis, so setData doesn't build an x array on every update
+        self._xaxis = np.arange(CHUNKSIZE, dtype=np.float32)
+
+        # Width of one FFT bin in Hz (bin k sits at k * _bin_hz); FFT_SIZE and SAMPLERATE never change
+        self._bin_hz = SAMPLERATE / FFT_SIZE
+
+        # Hann window for the pitch FFT (less leakage around the peak) and its scratch buffer
+        self._window = np.hanning(FFT_SIZE).astype(np.float32)
+        self._windowed = np.empty(FFT_SIZE, dtype=np.float32)
+
+        # pocketfft caches its plan per length/dtype; build the FFT_SIZE float32 plan up front
+        # and compile the spectrum kernel on that output instead of on the first tick
+        _spectral_peak(rfft(np.zeros(FFT_SIZE, dtype=np.float32)))
 
         # 4. --- Set up the audio stream ---
+        # The stream callback copies each new block into this preallocated buffer and
+        # flags it as fresh; the timer only reads it, so the GUI thread never blocks on audio
+        self._ring = np.zeros(CHUNKSIZE, dtype=np.float32)
+        self._history = np.zeros(FFT_SIZE, dtype=np.float32) # Last FFT_SIZE samples, oldest first
+        self._fresh = False
+        self._overflowed = False
+        self._print_counter = 0
         try:
             self.stream = sd.InputStream(
                 samplerate=SAMPLERATE,
                 channels=1,        # Mono audio
                 blocksize=CHUNKSIZE,
-                dtype='float32'    # Data type of the samples
+                dtype='float32',   # Data type of the samples
+                callback=self._on_audio
             )
             self.stream.start()
         except Exception as e:
@@ -51,56 +111,77 @@ class AudioMonitorWindow(QMainWindow):
         # 5. --- Set up the update timer ---
         self.timer = QTimer()
         self.timer.setInterval(30) # Refresh rate in milliseconds (approx. 33 FPS)
+        # Millisecond-accurate ticks instead of the default coarse timer's ±5% slack, so the
+        # redraw cadence stays steady against the 23 ms block rate
+        self.timer.setTimerType(Qt.TimerType.PreciseTimer)
         self.timer.timeout.connect(self.update_plot)
         self.timer.start()
 
+    def _on_audio(self, indata, frames, time_info, status):
+        """
+        Runs on the audio thread for every block.
+        'indata' has a shape of (CHUNKSIZE, 1); copy its only channel into the buffer.
+        """
+        if status.input_overflow:
+            self._overflowed = True
+        self._ring[:] = indata[:, 0]
+        # Slide the pitch history along by one block (every block, even if no tick reads it)
+        self._history[:-CHUNKSIZE] = self._history[CHUNKSIZE:]
+        self._history[-CHUNKSIZE:] = self._ring
+        self._fresh = True
+
     def update_plot(self):
         """
         This function is called by the QTimer.
-        It reads new data from the audio stream, updates the plot,
+        It takes the newest block delivered by the audio callback, updates the plot,
         and prints loudness and pitch to the console.
         """
+        if not self._fresh:
+            return # No new block since the last tick
+        self._fresh = False
         try:
-            # Read a chunk of data from the audio stream
-            data, overflowed = self.stream.read(CHUNKSIZE)
-            
-            if overflowed:
+            if self._overflowed:
+                self._overflowed = False
                 print("Warning: Audio buffer overflowed")
 
-            # 'data' has a shape of (CHUNKSIZE, 1). We 'flatten' it to 1D.
-            data_1d = data.flatten()
+            data_1d = self._ring
             
             # Update the plot
-            self.data_line.setData(data_1d)
+            self.data_line.setData(self._xaxis, data_1d)
 
-            # --- NEW: Calculate Loudness (RMS Amplitude) ---
-            # Square all values, get the mean, then take the square root.
-            rms_amplitude = np.sqrt(np.mean(np.square(data_1d)))
+            # The stats below only feed the console line, so only compute them when it is due
+            self._print_counter += 1
+            if self._print_counter < PRINT_EVERY:
+                return
+            self._print_counter = 0
 
-            # --- NEW: Calculate Pitch (Fundamental Frequency via FFT) ---
-            # Perform Fast Fourier Transform
-            fft_spectrum = np.abs(np.fft.rfft(data_1d))
-            
-            # Get the frequencies corresponding to the FFT bins
-            # 1.0 / SAMPLERATE is the sample spacing
-            fft_freqs = np.fft.rfftfreq(len(data_1d), 1.0 / SAMPLERATE)
-
-            # Find the peak frequency (ignoring the 0Hz DC offset)
-            peak_index = np.argmax(fft_spectrum[1:]) + 1
-            pitch_hz = fft_freqs[peak_index]
-            peak_magnitude = fft_spectrum[peak_index]
+            # --- NEW: Calculate Loudness (RMS Amplitude) ---
+            # Sum of squares as one dot product (no squared temporary), then mean and square root.
+            rms_amplitude = np.sqrt(data_1d @ data_1d / CHUNKSIZE)
 
             # --- NEW: Simple Voicing Detection ---
-            # If the signal is very quiet or the peak isn't prominent,
-            # it's likely unvoiced (noise/silence).
-            if rms_amplitude < 0.005 or peak_magnitude < np.mean(fft_spectrum[1:]) * 10:
+            # If the signal is very quiet it's unvoiced (silence), and the FFT is skipped.
+            if rms_amplitude < SILENCE_RMS:
                 display_pitch = "--- (unvoiced)"
             else:
-                display_pitch = f"{pitch_hz:7.1f} Hz"
+                # --- NEW: Calculate Pitch (Fundamental Frequency via FFT) ---
+                # Perform Fast Fourier Transform on the windowed pitch history; power |X|^2 of each bin,
+                # its peak (ignoring the 0Hz DC offset) and its mean come from one kernel pass
+                np.multiply(self._history, self._window, out=self._windowed)
+                peak_bin, peak_power, mean_power = _spectral_peak(rfft(self._windowed, overwrite_x=True))
+                pitch_hz = peak_bin * self._bin_hz
+
+                # If the peak isn't prominent (less than 20 dB above the mean
+                # bin power, i.e. 10x in amplitude), it's likely unvoiced (noise).
+                if peak_power < mean_power * 100:
+                    display_pitch = "--- (unvoiced)"
+                else:
+                    display_pitch = f"{pitch_hz:7.1f} Hz"
 
             # --- NEW: Print to Console ---
             # Use carriage return '\r' to print on the same line
-            print(f"Loudness (RMS): {rms_amplitude:.4f}  |  Pitch: {display_pitch}      ", end='\r')
+            sys.stdout.write(f"Loudness (RMS): {rms_amplitude:.4f}  |  Pitch: {display_pitch}      \r")
+            sys.stdout.flush() # No newline, so line buffering would otherwise hold it back
 
 
         except Exception as e: